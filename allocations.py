@@ -0,0 +1,125 @@
+'''Allocation tracking for the frame loop, to find the code that makes work for the garbage collector.
+
+Python 2 has no tracemalloc, so the tracker watches what the cyclic collector sees: objects that can
+hold references (lists, tuples, dicts, instances, ...). A collection of the youngest generation runs
+whenever the number of such objects allocated minus those freed crosses a threshold. The tracker
+traces the lines of the game's own modules and books the change of that number on the line that
+caused it. Calls into other code, such as numpy or the standard library, count for the calling line.
+At the end of every frame it also lists the objects the frame left behind for the collector, cyclic
+garbage and whatever was kept, with their sizes. Objects the collector doesn't track (floats,
+pygame.Color, numpy arrays) are freed as soon as they are dropped and never trigger a collection.
+
+Tracing slows the game down a lot, it is meant to be switched on while looking for garbage.'''
+
+import gc
+import os
+import sys
+import linecache
+
+OTHER = ('<other>', 0)
+
+class AllocationTracker:
+    '''Call start_frame() and end_frame() around every frame, get_report() for the results.
+    Only the code in files below directory is traced, the game directory by default.'''
+    def __init__(self, directory = None):
+        self.directory = os.path.abspath(directory or os.path.dirname(os.path.abspath(__file__)))
+        self.traced = {}        # code file name -> whether it is traced
+        self.lines = {}         # (file, line) -> objects allocated
+        self.frames = []        # (objects allocated, objects left, bytes left) per frame
+        self.types = {}         # type name -> objects left
+        self.line = OTHER
+        self.count = 0
+        self.allocated = 0
+        self.ids = None
+        self.gc_enabled = False
+        # bound once, binding allocates too
+        self.local_trace = self.trace_line
+
+    def is_traced(self, filename):
+        traced = self.traced.get(filename)
+        if traced is None:
+            traced = self.traced[filename] = os.path.abspath(filename).startswith(self.directory + os.sep)
+        return traced
+
+    def book(self):
+        '''Books the change of the collector's count since the last trace event on the current line.'''
+        delta = gc.get_count()[0] - self.count
+        if delta > 0:
+            self.lines[self.line] = self.lines.get(self.line, 0) + delta
+            self.allocated += delta
+
+    def trace_call(self, frame, event, arg):
+        if event != 'call':
+            return None
+        self.book()
+        filename = frame.f_code.co_filename
+        trace = None
+        # allocations in code that isn't traced count for the calling line
+        if self.is_traced(filename):
+            self.line = (os.path.basename(filename), frame.f_lineno)
+            trace = self.local_trace
+        # what the tracker allocates itself doesn't count
+        self.count = gc.get_count()[0]
+        return trace
+
+    def trace_line(self, frame, event, arg):
+        self.book()
+        if event == 'line':
+            self.line = (os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+        elif event == 'return':
+            caller = frame.f_back
+            if caller and self.is_traced(caller.f_code.co_filename):
+                self.line = (os.path.basename(caller.f_code.co_filename), caller.f_lineno)
+            else:
+                self.line = OTHER
+        self.count = gc.get_count()[0]
+        return self.local_trace
+
+    def start_frame(self):
+        # without automatic collections the count only goes up and garbage stays to be seen
+        self.gc_enabled = gc.isenabled()
+        gc.disable()
+        self.ids = set(id(x) for x in gc.get_objects())
+        self.allocated = 0
+        self.line = OTHER
+        self.count = gc.get_count()[0]
+        sys.settrace(self.trace_call)
+
+    def end_frame(self):
+        sys.settrace(None)
+        self.book()
+        ids = self.ids
+        self.ids = None
+        objects = gc.get_objects()
+        # leaving out the tracker's own objects
+        this = sys._getframe()
+        left = [x for x in objects if not id(x) in ids and x is not ids and x is not objects and x is not this]
+        del objects, this
+        size = 0
+        for x in left:
+            size += sys.getsizeof(x)
+            name = type(x).__name__
+            self.types[name] = self.types.get(name, 0) + 1
+        self.frames.append((self.allocated, len(left), size))
+        del left
+        if self.gc_enabled:
+            gc.enable()
+
+    def get_report(self, top = 15):
+        '''Returns a text listing the lines that allocated the most objects and the objects left per frame.'''
+        n = len(self.frames)
+        if not n:
+            return 'no frames tracked'
+        allocated = sum(x[0] for x in self.frames) / float(n)
+        objects = sum(x[1] for x in self.frames) / float(n)
+        size = sum(x[2] for x in self.frames) / float(n)
+        report = ['%d frames: %.1f objects allocated per frame, %.1f objects (%.0f bytes) per frame left for the collector, at most %d (%d bytes)' %
+            (n, allocated, objects, size, max(x[1] for x in self.frames), max(x[2] for x in self.frames))]
+        report.append('top allocating lines, objects per frame:')
+        for (filename, line), count in sorted(self.lines.items(), key = lambda x: -x[1])[:top]:
+            path = os.path.join(self.directory, filename)
+            source = linecache.getline(path, line).strip() if line else ''
+            report.append('%9.1f  %s:%d  %s' % (count / float(n), filename, line, source))
+        report.append('objects left, per frame: ' + ', '.join('%s %.1f' % (name, count / float(n))
+            for name, count in sorted(self.types.items(), key = lambda x: -x[1])[:top]))
+        return '\n'.join(report)
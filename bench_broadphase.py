@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''Compares the grid broad phase with the all-pairs loop for a growing number of collidables.
+Collidables are boxes of spacecraft and shot size moving around at constant density, only
+spacecraft/shot pairs are counted.'''
+
+import random
+import time
+import numpy
+import broadphase
+
+FRAMES = 10
+NAIVE_MAX = 2000    # the all-pairs loop takes ages beyond this
+
+def make_boxes(n):
+    # keep roughly one collidable per 100x100 pixels
+    side = (n * 100.0 * 100.0) ** .5
+    boxes = []
+    for i in xrange(0, n):
+        size = 30.0 if random.random() < .05 else 10.0
+        boxes.append([random.random() * side, random.random() * side, size, random.random() * 4 - 2, random.random() * 4 - 2])
+    return boxes
+
+def get_bounds(box):
+    return (box[0], box[1], box[0] + box[2], box[1] + box[2])
+
+def move(boxes):
+    for box in boxes:
+        box[0] += box[3]
+        box[1] += box[4]
+
+def split(boxes):
+    '''Returns the bounds of the spacecraft boxes and of the shot boxes.'''
+    spacecrafts = [get_bounds(box) for box in boxes if box[2] > 10]
+    shots = [get_bounds(box) for box in boxes if box[2] <= 10]
+    return spacecrafts, shots
+
+def run_naive(boxes):
+    pairs = 0
+    for frame in xrange(0, FRAMES):
+        move(boxes)
+        spacecrafts, shots = split(boxes)
+        for a in spacecrafts:
+            for b in shots:
+                if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+                    pairs += 1
+    return pairs
+
+def run_grid(boxes):
+    pairs = 0
+    for frame in xrange(0, FRAMES):
+        move(boxes)
+        spacecrafts, shots = split(boxes)
+        i, j = broadphase.get_pairs_between(numpy.array(spacecrafts).reshape(-1, 4), numpy.array(shots).reshape(-1, 4), 64)
+        pairs += len(i)
+    return pairs
+
+if __name__ == '__main__':
+    print '%8s %14s %14s %10s' % ('n', 'all-pairs ms', 'grid ms', 'pairs')
+    for n in (10, 50, 100, 500, 1000, 2000, 5000):
+        random.seed(n)
+        boxes = make_boxes(n)
+        start = time.time()
+        pairs = run_grid([list(box) for box in boxes])
+        t_grid = (time.time() - start) * 1000 / FRAMES
+        if n <= NAIVE_MAX:
+            start = time.time()
+            pairs_naive = run_naive([list(box) for box in boxes])
+            t_naive = '%14.2f' % ((time.time() - start) * 1000 / FRAMES)
+            assert pairs == pairs_naive
+        else:
+            t_naive = '%14s' % '-'
+        print '%8d %s %14.2f %10d' % (n, t_naive, t_grid, pairs / FRAMES)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''Memory benchmark of the shape classes. Compares the former shape classes (instance dicts
+holding lists of Python floats) with the slotted, array-backed ones in world.py, standalone and
+bound to a fleet's buffer, by deep size and number of objects the garbage collector tracks.
+
+./bench_shapes.py               # 10000 spacecrafts' worth of shapes
+./bench_shapes.py -n 1000'''
+
+import argparse
+import gc
+import sys
+import numpy
+import world
+import fleet
+
+class OldLine:
+    def __init__(self, color, start, end):
+        self.color = color
+        self.start = start
+        self.end = end
+        self.real_start = [.0, .0]
+        self.real_end = [.0, .0]
+
+class OldCircle:
+    def __init__(self, color, center, radius):
+        self.color = color
+        self.center = center
+        self.radius = radius
+        self.real_center = [.0, .0]
+
+class OldPoly:
+    def __init__(self, color, pointlist):
+        self.color = color
+        self.pointlist = pointlist
+        self.real_pointlist = [[.0, .0] for x in pointlist]
+
+def convert(shape):
+    '''Returns the former counterpart of a shape.'''
+    if isinstance(shape, world.Line):
+        return OldLine(shape.color, shape.start.tolist(), shape.end.tolist())
+    if isinstance(shape, world.Circle):
+        return OldCircle(shape.color, shape.center.tolist(), shape.radius)
+    return OldPoly(shape.color, shape.pointlist.tolist())
+
+def walk(obj, seen, totals):
+    '''Adds sys.getsizeof() of obj and everything it references to totals['bytes'], and the objects
+    the garbage collector tracks to totals['tracked'], counting every object once. Arrays that are
+    views only count their header, the data belongs to their base.'''
+    if id(obj) in seen or isinstance(obj, type):
+        return
+    seen.add(id(obj))
+    totals['bytes'] += sys.getsizeof(obj)
+    totals['tracked'] += gc.is_tracked(obj)
+    if isinstance(obj, numpy.ndarray):
+        if obj.base is not None:
+            totals['bytes'] -= obj.nbytes
+            walk(obj.base, seen, totals)
+        return
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            walk(k, seen, totals)
+            walk(v, seen, totals)
+    elif isinstance(obj, (list, tuple)):
+        for x in obj:
+            walk(x, seen, totals)
+    if hasattr(obj, '__dict__'):
+        walk(obj.__dict__, seen, totals)
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if hasattr(obj, slot):
+                walk(getattr(obj, slot), seen, totals)
+
+def measure(shapes):
+    '''Returns the deep size and the number of gc tracked objects of a shape list, without the list.'''
+    # the colors are shared by all shapes
+    seen = set([id(shapes)] + [id(part.shapes[0].color) for part in world.build_player().parts])
+    totals = {'bytes': 0, 'tracked': 0}
+    for shape in shapes:
+        walk(shape, seen, totals)
+    return totals['bytes'], totals['tracked']
+
+def build_spacecrafts(n):
+    builders = [world.build_player, world.build_hostile_one, world.build_hostile_two]
+    return [builders[i % len(builders)]() for i in xrange(0, n)]
+
+def get_shapes(spacecrafts):
+    return [shape for s in spacecrafts for part in s.parts for shape in part.shapes]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compares the memory used by the former and the current shape classes.')
+    parser.add_argument('-n', '--spacecrafts', type = int, default = 10000)
+    args = parser.parse_args()
+
+    shapes = get_shapes(build_spacecrafts(args.spacecrafts))
+    print '%d shapes of %d spacecrafts' % (len(shapes), args.spacecrafts)
+    results = [('former classes', measure([convert(shape) for shape in shapes])), ('slotted arrays', measure(shapes))]
+    # bind the real coordinates to one buffer, like the world does
+    f = fleet.Fleet(build_spacecrafts(args.spacecrafts))
+    f.rebuild()
+    results.append(('bound to fleet', measure(get_shapes(f.ships))))
+    print '%-16s %12s %10s %12s' % ('', 'bytes/shape', 'gc/shape', 'total MiB')
+    for name, (size, tracked) in results:
+        print '%-16s %12.1f %10.2f %12.2f' % (name, float(size) / len(shapes), float(tracked) / len(shapes), size / 1048576.0)
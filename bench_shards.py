@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''Benchmark of the sharded world. Runs the same battle of two factions in one world.World and in
+shards.ShardedWorld with different numbers of worker processes and reports the time per tick.
+Sharding pays off with as many cores as shards.
+
+./bench_shards.py                       # 2000 spacecrafts, 1, 2 and 4 shards
+./bench_shards.py -n 500 -t 120 -s 1 2 8'''
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import math
+import multiprocessing
+import random
+import time
+import world
+import shards
+import pilots
+
+SCREEN_SIZE = [1024, 700]
+TIMESPAN = 1.0 / 60
+BUILDERS = ['hostile_one', 'hostile_two']
+
+def spawn_battle(n, width, height):
+    '''Returns n piloted spacecrafts of two factions spread over width x height around the origin.'''
+    spacecrafts = []
+    for i in xrange(0, n):
+        spacecraft = world.blueprints[BUILDERS[i % len(BUILDERS)]].spawn()
+        spacecraft.faction = world.FACTION_PLAYER if i % 2 else world.FACTION_HOSTILE
+        spacecraft.position = [(random.random() - .5) * width, (random.random() - .5) * height]
+        spacecraft.rotation = random.random() * math.pi * 2
+        spacecrafts.append(spacecraft)
+    return spacecrafts
+
+def run_world(n, ticks, width, height):
+    random.seed(0)
+    w = world.World(SCREEN_SIZE, False, False)
+    for spacecraft in spawn_battle(n, width, height):
+        spacecraft.pilot = pilots.AI_Pilot_Basic(spacecraft, w)
+        w.add_entity(spacecraft)
+    start = time.time()
+    for tick in xrange(0, ticks):
+        w.process(TIMESPAN)
+    return (time.time() - start) * 1000 / ticks, len(w.spacecrafts)
+
+def run_sharded(n, ticks, width, height, count):
+    random.seed(0)
+    sharded = shards.ShardedWorld(SCREEN_SIZE, count, width / count)
+    for spacecraft in spawn_battle(n, width, height):
+        sharded.add_entity(spacecraft, piloted = True)
+    start = time.time()
+    for tick in xrange(0, ticks):
+        sharded.process(TIMESPAN)
+    elapsed = time.time() - start
+    sharded.close()
+    return elapsed * 1000 / ticks, len(sharded.view.spacecrafts)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compares a world with sharded worlds on a large battle.')
+    parser.add_argument('-n', '--spacecrafts', type = int, default = 2000)
+    parser.add_argument('-t', '--ticks', type = int, default = 300)
+    parser.add_argument('-s', '--shards', type = int, nargs = '*', default = [1, 2, 4])
+    parser.add_argument('--width', type = float, default = 16000.0)
+    parser.add_argument('--height', type = float, default = 4000.0)
+    args = parser.parse_args()
+
+    print '%d spacecrafts, %d ticks, %d cores' % (args.spacecrafts, args.ticks, multiprocessing.cpu_count())
+    ms, left = run_world(args.spacecrafts, args.ticks, args.width, args.height)
+    print '%-10s %9.2f ms per tick, %d spacecrafts left' % ('world', ms, left)
+    for count in args.shards:
+        ms, left = run_sharded(args.spacecrafts, args.ticks, args.width, args.height, count)
+        print '%-10s %9.2f ms per tick, %d spacecrafts left' % ('%d shards' % count, ms, left)
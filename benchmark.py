@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+'''Headless benchmark. Runs canned scenarios for a fixed number of ticks without a display
+(SDL's dummy video driver) and reports per-phase timings, optionally as a JSON results file.
+
+./benchmark.py                              # all scenarios
+./benchmark.py brawl storm -t 300 -o results.json
+./benchmark.py custom --spacecrafts 20 --pilots 10 --shots 500 --particles 2000'''
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import json
+import math
+import numpy
+import platform
+import random
+import time
+import pygame
+import world
+import drawing
+import pilots
+import profiler
+
+SCREEN_SIZE = [1024, 700]
+TIMESPAN = 1.0 / 60
+
+BUILDERS = [world.build_hostile_one, world.build_hostile_two]
+
+def populate(w, spacecrafts = 0, pilots_count = 0, shots = 0, particles = 0, builders = BUILDERS, radius = 400, factions = None):
+    '''Adds spacecrafts around the player, the first pilots_count of them piloted, plus free shots and particles.
+    factions, if given, are handed out to the spacecrafts in turn.'''
+    for i in xrange(0, spacecrafts):
+        spacecraft = builders[i % len(builders)]()
+        if factions:
+            spacecraft.faction = factions[i % len(factions)]
+        angle = random.random() * math.pi * 2
+        dist = random.random() * radius
+        spacecraft.position = [math.cos(angle) * dist, math.sin(angle) * dist]
+        spacecraft.rotation = random.random() * math.pi * 2
+        if i < pilots_count:
+            spacecraft.pilot = pilots.AI_Pilot_Basic(spacecraft, w)
+        w.add_entity(spacecraft)
+    color = tuple(w.player.parts[0].shapes[0].color)[:3]
+    for i in xrange(0, shots):
+        angle = random.random() * math.pi * 2
+        ttl = random.random() * 2 + 1
+        x = (random.random() - .5) * radius * 2
+        y = (random.random() - .5) * radius * 2
+        w.shots.add(1, ttl, w.player.handle, color, x, y, math.cos(angle) * 150, math.sin(angle) * 150, w.player.faction)
+    angle = numpy.random.random(particles) * math.pi * 2
+    w.particles.emit((255, 232, 0), numpy.random.random(particles) * 4 + 1, (numpy.random.random(particles) - .5) * radius * 2,
+        (numpy.random.random(particles) - .5) * radius * 2, numpy.cos(angle) * 50, numpy.sin(angle) * 50)
+
+def player_fires(w, tick):
+    w.player.rotate(tick * .05)
+    w.player.fire = True
+
+def storm(w, tick):
+    '''Blows up all motherships every second and brings them back.'''
+    if tick % 60 == 0:
+        for spacecraft in filter(lambda x: x is not w.player, w.spacecrafts):
+            spacecraft.explode(w)
+        populate(w, 10, 10, builders = [world.build_hostile_mudda_one])
+
+def check_shot_origins(w):
+    '''Raises an AssertionError if a shot fired in the last tick didn't start at its spacecraft.'''
+    shots = w.shots
+    for i in xrange(0, shots.count):
+        spacecraft = w.entities.get(int(shots.origin[i]))
+        if not spacecraft:
+            continue
+        weapons = [part.stats for part in spacecraft.weapons if shots.ttl[i] > part.stats.attack_ttl - TIMESPAN * 1.5]
+        if not weapons:
+            continue
+        # the weapon is within the spacecraft's radius, both moved one tick since
+        reach = spacecraft.radius + (max(stats.attack_speed for stats in weapons) + spacecraft.stats.speed_max) * TIMESPAN + 1
+        x, y = shots.position[i].tolist()
+        assert math.hypot(x - spacecraft.position[0], y - spacecraft.position[1]) <= reach, \
+            'shot at (%.1f, %.1f) far from its spacecraft at (%.1f, %.1f)' % (x, y, spacecraft.position[0], spacecraft.position[1])
+
+def churn(w, tick):
+    '''Adds a piloted spacecraft every 20 ticks, so the fleet is rebuilt while everybody fires, and
+    checks that shots still start at their spacecrafts.'''
+    check_shot_origins(w)
+    if tick % 20 == 0:
+        populate(w, 1, 1, radius = 800, factions = [world.FACTION_PLAYER, world.FACTION_HOSTILE])
+
+SCENARIOS = {
+    'baseline': dict(),
+    'brawl': dict(spacecrafts = 49, pilots_count = 49, hook = player_fires),
+    'storm': dict(hook = storm),
+    'battle': dict(spacecrafts = 200, pilots_count = 200, radius = 1500, factions = [world.FACTION_PLAYER, world.FACTION_HOSTILE]),
+    'churn': dict(spacecrafts = 60, pilots_count = 60, radius = 800, factions = [world.FACTION_PLAYER, world.FACTION_HOSTILE], hook = churn),
+}
+
+def draw_list(function, items):
+    for item in items:
+        function(item)
+
+def run_scenario(drawer, ticks, hook = None, **counts):
+    '''Runs a scenario for ticks frames, each a tick of World.process() followed by the render passes
+    of main.py, timed by a profiler.Profiler. A hook, if given, runs as the input of every frame.'''
+    random.seed(0)
+    numpy.random.seed(0)
+    w = world.World(SCREEN_SIZE, False)
+    populate(w, **counts)
+    frame_profiler = profiler.Profiler(ticks)
+    frame_start = time.time()
+    frame_profiler.lap_time = frame_start
+    for tick in xrange(0, ticks):
+        if hook:
+            hook(w, tick)
+        frame_profiler.lap('input')
+        w.process(TIMESPAN, frame_profiler)
+        w.interpolate(1.0, TIMESPAN)
+        frame_profiler.lap('interpolate')
+        drawer.camera.position = list(w.player.render_position)
+        drawer.surface.fill(drawer.col_black)
+        drawer.draw_background(w.background, True)
+        frame_profiler.lap('draw_background')
+        draw_list(drawer.draw_planet, w.planets)
+        frame_profiler.lap('draw_planets')
+        draw_list(drawer.draw_spacecraft, w.spacecrafts)
+        frame_profiler.lap('draw_spacecrafts')
+        drawer.draw_shots(w.shots)
+        frame_profiler.lap('draw_shots')
+        drawer.draw_particles(w.particles, w.render_lag)
+        frame_profiler.lap('draw_particles')
+        drawer.draw_lens_flares()
+        frame_profiler.lap('draw_lens_flares')
+        frame_profiler.count('spacecrafts', len(w.spacecrafts))
+        frame_profiler.count('shots', len(w.shots))
+        frame_profiler.count('particles', len(w.particles))
+        frame_profiler.end_frame()
+    elapsed = time.time() - frame_start
+    frames = frame_profiler.get_frames()[0]
+    phases = {}
+    for phase in profiler.PHASES:
+        t = frame_profiler.get_column(frames, phase)
+        phases[phase] = {'total_ms': float(t.sum()), 'mean_ms': float(t.mean()), 'max_ms': float(t.max())}
+    return {'ticks': ticks, 'total_ms': elapsed * 1000, 'frame_ms': elapsed * 1000 / ticks, 'phases': phases,
+        'counters': dict((counter, float(frame_profiler.get_column(frames, counter).mean())) for counter in profiler.COUNTERS),
+        'entities': {'spacecrafts': len(w.spacecrafts), 'shots': len(w.shots), 'particles': len(w.particles)}}
+
+def print_results(name, results):
+    print '%s: %d ticks, %.2f ms per frame' % (name, results['ticks'], results['frame_ms'])
+    for phase in profiler.PHASES:
+        r = results['phases'][phase]
+        # the phases of main.py a headless run doesn't have
+        if not r['max_ms']:
+            continue
+        print '  %-18s %9.3f ms mean %9.3f ms max' % (phase, r['mean_ms'], r['max_ms'])
+    print '  per frame: %s' % ', '.join('%s %.1f' % (counter, results['counters'][counter]) for counter in profiler.COUNTERS)
+    print '  entities at the end: %s' % ', '.join('%s %d' % x for x in sorted(results['entities'].items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs headless world benchmarks.')
+    parser.add_argument('scenarios', nargs = '*', help = 'scenarios to run: %s, custom (default: all canned ones)' % ', '.join(sorted(SCENARIOS)))
+    parser.add_argument('-t', '--ticks', type = int, default = 600)
+    parser.add_argument('-o', '--output', help = 'write results to this JSON file')
+    parser.add_argument('--spacecrafts', type = int, default = 0, help = 'spacecrafts besides the player in the custom scenario')
+    parser.add_argument('--pilots', type = int, default = 0, help = 'how many of them are piloted')
+    parser.add_argument('--shots', type = int, default = 0)
+    parser.add_argument('--particles', type = int, default = 0)
+    args = parser.parse_args()
+
+    # images are loaded relative to the game directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    surface = pygame.display.set_mode(SCREEN_SIZE, 0, 32)
+    drawer = drawing.Drawer(surface, drawing.Camera(SCREEN_SIZE, 0.0, 0.0))
+
+    scenarios = dict(SCENARIOS)
+    scenarios['custom'] = dict(spacecrafts = args.spacecrafts, pilots_count = args.pilots, shots = args.shots, particles = args.particles)
+    names = args.scenarios or sorted(SCENARIOS)
+    results = {'python': platform.python_version(), 'pygame': pygame.version.ver, 'time': time.time(), 'scenarios': {}}
+    for name in names:
+        if not name in scenarios:
+            parser.error('unknown scenario: ' + name)
+        results['scenarios'][name] = run_scenario(drawer, args.ticks, **scenarios[name])
+        print_results(name, results['scenarios'][name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
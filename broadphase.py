@@ -0,0 +1,41 @@
+'''Broad phase collision detection.'''
+
+import numpy
+
+def get_pairs_between(bounds1, bounds2, cell_size = 64):
+    '''Vectorized broad phase between two sets of boxes, (n, 4) arrays of (min_x, min_y, max_x, max_y)
+    rows. Returns the index arrays (i, j) of all pairs of overlapping boxes bounds1[i] and bounds2[j],
+    sorted by i, then j. Every box of bounds2 goes into the cell of its min corner, every box of
+    bounds1 into all cells such a box overlapping it can start in, so bounds2 should hold the small
+    boxes, e.g. shots.'''
+    if not len(bounds1) or not len(bounds2):
+        return numpy.zeros(0, dtype = int), numpy.zeros(0, dtype = int)
+    c = float(cell_size)
+    extent = (bounds2[:, 2:4] - bounds2[:, 0:2]).max(axis = 0)
+    low = numpy.floor((bounds1[:, 0:2] - extent) / c).astype(int)
+    high = numpy.floor(bounds1[:, 2:4] / c).astype(int)
+    cells2 = numpy.floor(bounds2[:, 0:2] / c).astype(int)
+    # cells numbered row by row over the range of cells involved
+    origin = numpy.minimum(low.min(axis = 0), cells2.min(axis = 0))
+    rows = max(high[:, 1].max(), cells2[:, 1].max()) - origin[1] + 1
+    keys2 = (cells2[:, 0] - origin[0]) * rows + cells2[:, 1] - origin[1]
+    # one entry per box of bounds1 and cell it covers
+    size = high - low + 1
+    counts = size[:, 0] * size[:, 1]
+    owners = numpy.repeat(numpy.arange(len(bounds1)), counts)
+    k = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    keys1 = (low[owners, 0] + k // size[owners, 1] - origin[0]) * rows + low[owners, 1] + k % size[owners, 1] - origin[1]
+    # join the entries with the boxes of bounds2 in the same cell
+    order = numpy.argsort(keys2, kind = 'mergesort')
+    keys2 = keys2[order]
+    start = numpy.searchsorted(keys2, keys1, 'left')
+    counts = numpy.searchsorted(keys2, keys1, 'right') - start
+    i = numpy.repeat(owners, counts)
+    j = order[numpy.repeat(start - (numpy.cumsum(counts) - counts), counts) + numpy.arange(counts.sum())]
+    b1 = bounds1[i]
+    b2 = bounds2[j]
+    overlap = (b1[:, 0] <= b2[:, 2]) & (b2[:, 0] <= b1[:, 2]) & (b1[:, 1] <= b2[:, 3]) & (b2[:, 1] <= b1[:, 3])
+    i = i[overlap]
+    j = j[overlap]
+    order = numpy.lexsort((j, i))
+    return i[order], j[order]
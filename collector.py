@@ -0,0 +1,81 @@
+'''Frame-aware garbage collection.
+
+Python's cyclic collector runs whenever enough objects have been allocated, which in the frame loop
+means somewhere in the middle of simulating or drawing a frame. The Collector switches automatic
+collection off and collects in the idle time at the end of a frame instead, before waiting for the
+frame clock. Young generations are collected when they are due and their last pause fits into the
+time left. Full collections only run at safe points: when requested, e.g. when a spacecraft
+explodes or a level starts, and not more often than every full_spacing seconds.
+
+If frames leave no idle time, e.g. in replays that run as fast as they can, the youngest
+generation is collected anyway once its count is hard_limit times its threshold, so memory
+stays bounded.'''
+
+import gc
+import time
+
+class Collector:
+    def __init__(self, hard_limit = 4, full_spacing = 5.0):
+        self.thresholds = gc.get_threshold()
+        self.hard_limit = hard_limit
+        self.full_spacing = full_spacing
+        self.full_requested = False
+        self.last_full = None       # time.time() of the last full collection
+        self.collections = [0, 0, 0]
+        self.pause_total = [.0, .0, .0]     # ms per generation
+        self.pause_max = [.0, .0, .0]
+        self.pause_estimate = [.0, .0, .0]  # of the next pause, ms
+        self.gc_enabled = True
+
+    def start(self):
+        '''Takes over from automatic collection.'''
+        self.gc_enabled = gc.isenabled()
+        gc.disable()
+
+    def stop(self):
+        if self.gc_enabled:
+            gc.enable()
+
+    def collect(self, generation):
+        '''Collects generation and the younger ones, returns the pause in ms.'''
+        start = time.time()
+        gc.collect(generation)
+        ms = (time.time() - start) * 1000
+        self.collections[generation] += 1
+        self.pause_total[generation] += ms
+        self.pause_max[generation] = max(self.pause_max[generation], ms)
+        # pauses grow with the number of objects, recent ones tell more
+        self.pause_estimate[generation] = ms if self.collections[generation] == 1 else (self.pause_estimate[generation] + ms) / 2
+        if generation == 2:
+            self.last_full = time.time()
+            self.full_requested = False
+        return ms
+
+    def request_full(self):
+        '''Marks a safe point: a full collection runs at the next idle(), unless there was one recently.'''
+        if self.last_full is None or time.time() - self.last_full >= self.full_spacing:
+            self.full_requested = True
+
+    def idle(self, idle_time):
+        '''Collects what is due within the idle_time seconds left of the frame. Returns the number
+        of collections.'''
+        left = idle_time * 1000
+        count = gc.get_count()
+        if self.full_requested:
+            self.collect(2)
+            return 1
+        if count[1] >= self.thresholds[1] and (self.pause_estimate[1] <= left or count[1] >= self.hard_limit * self.thresholds[1]):
+            self.collect(1)
+            return 1
+        if count[0] >= self.thresholds[0] and (self.pause_estimate[0] <= left or count[0] >= self.hard_limit * self.thresholds[0]):
+            self.collect(0)
+            return 1
+        return 0
+
+    def get_report(self):
+        lines = []
+        for generation in xrange(0, 3):
+            n = self.collections[generation]
+            lines.append('generation %d: %d collections, %.3f ms mean pause, %.3f ms max' %
+                (generation, n, self.pause_total[generation] / max(n, 1), self.pause_max[generation]))
+        return '\n'.join(lines)
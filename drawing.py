@@ -1,7 +1,10 @@
 import pygame
+from pygame.locals import *
 import random
 import math
 import copy
+import collections
+import numpy
 import world
 import engine
 import lightning
@@ -32,6 +35,12 @@ class Drawer:
         self.surf_planet1_small = pygame.transform.scale(self.surf_planet1, (48, 48))
         self.lighter = lightning.Lightning()
         self.lens_flares = []
+        # rendered tiles of the background, (band, tx, ty, pix_anti_alias) -> surface, least recently drawn first
+        self.star_tiles = collections.OrderedDict()
+        # profiler overlay, made on first use
+        self.profiler_graph = None
+        self.profiler_legend = None
+        self.profiler_legend_frame = 0
 
     def place_lens_flare(self, x, y, intensitiy):
         if intensitiy > 0:
@@ -43,56 +52,79 @@ class Drawer:
         self.lens_flares = []
 
     def draw_background(self, background, pix_anti_alias = True):
-        '''Draws the background (stars that is).
-        If pix_anti_alias is set to True, real pixel anti-aliasing is used (slow),
-        if set to False, the method uses short aa-lines to mimic pixels (fast).'''
+        '''Draws the background (stars that is), farthest band first, each as the tiles in view.
+        Tiles are rendered once and kept until they have been out of view for a while.
+        If pix_anti_alias is set to True, stars are splatted bilinearly onto the four pixels around them,
+        if set to False, they are plotted on their nearest pixel.'''
+        size = background.tile_size
+        (w, h) = self.camera.screen_size
+        tiles = self.star_tiles
+        for band in xrange(len(background.depths) - 1, -1, -1):
+            z = background.depths[band]
+            left = int(math.floor(self.camera.position[0] / z - self.camera.half_screen_size[0]))
+            top = int(math.floor(self.camera.position[1] / z - self.camera.half_screen_size[1]))
+            for tx in xrange(left // size, (left + w - 1) // size + 1):
+                for ty in xrange(top // size, (top + h - 1) // size + 1):
+                    key = (band, tx, ty, pix_anti_alias)
+                    tile = tiles.pop(key, None)
+                    if tile is None:
+                        tile = self.render_star_tile(background, band, tx, ty, pix_anti_alias)
+                    tiles[key] = tile
+                    self.surface.blit(tile, (tx * size - left, ty * size - top))
+        # room for twice the tiles in view, the others go
+        capacity = 2 * len(background.depths) * (w // size + 2) * (h // size + 2)
+        while len(tiles) > capacity:
+            tiles.popitem(False)
+
+    def render_star_tile(self, background, band, tx, ty, pix_anti_alias):
+        x, y, colors = background.get_tile(band, tx, ty)
+        tile = pygame.Surface((background.tile_size, background.tile_size), 0, self.surface)
+        tile.fill(self.col_black)
+        self.draw_points(x, y, colors, pix_anti_alias, tile)
+        # black is see-through, run-length encoded blits skip it quickly
+        tile.set_colorkey(self.col_black, RLEACCEL)
+        return tile
+
+    def draw_points(self, x, y, colors, pix_anti_alias = True, surface = None):
+        '''Adds colors to the surface at the points (x[i], y[i]), see add_pixels(). If pix_anti_alias is
+        set to True, every point is splatted bilinearly onto the four pixels around it, else it is
+        plotted on its nearest pixel.'''
         if pix_anti_alias:
-            pix = pygame.PixelArray(self.surface)
-            w = len(pix)
-            h = len(pix[0])
+            ix = numpy.floor(x).astype(int)
+            iy = numpy.floor(y).astype(int)
+            dx = x - ix
+            dy = y - iy
+            # each point's color is spread over its pixel and the ones right and below, by how much they overlap
+            x = numpy.concatenate((ix, ix + 1, ix, ix + 1))
+            y = numpy.concatenate((iy, iy, iy + 1, iy + 1))
+            weights = numpy.concatenate(((1 - dx) * (1 - dy), dx * (1 - dy), (1 - dx) * dy, dx * dy))
+            colors = numpy.tile(colors, (4, 1)) * weights[:, numpy.newaxis]
         else:
-            (w, h) = self.surface.get_size()
-        for star in background.stars:
-            x = (star.position[0] - self.camera.position[0]) / float(star.position[2]) + self.camera.half_screen_size[0]
-            y = (star.position[1] - self.camera.position[1]) / float(star.position[2]) + self.camera.half_screen_size[1]
-            if x >= 0 and x < self.camera.screen_size[0] and y >= 0 and y < self.camera.screen_size[1]:
-                # real pixel AA
-                if pix_anti_alias:
-                    dx = x - math.floor(x)
-                    dy = y - math.floor(y)
-                    dx1 = (1 - dx)
-                    dy1 = (1 - dy)
-                    ix = int(math.floor(x))
-                    iy = int(math.floor(y))
-                    c0x1 = star.color[0] * dx1
-                    c0y1 = star.color[0] * dy1
-                    c1x1 = star.color[1] * dx1
-                    c1y1 = star.color[1] * dy1
-                    c2x1 = star.color[2] * dx1
-                    c2y1 = star.color[2] * dy1
-                    c0x0 = star.color[0] * dx
-                    c0y0 = star.color[0] * dy
-                    c1x0 = star.color[1] * dx
-                    c1y0 = star.color[1] * dy
-                    c2x0 = star.color[2] * dx
-                    c2y0 = star.color[2] * dy
-                    pix[ix][iy] = ((c0x1 + c0y1) / 2, (c1x1 + c1y1) / 2, (c2x1 + c2x1) / 2)
-                    if ix + 1 < w:
-                        pix[ix + 1][iy] = ((c0x0 + c0y1) / 2, (c1x0 + c1y1) / 2, (c2x0 + c2x1) / 2)
-                    else:
-                        continue
-                    if iy + 1 < h:
-                        pix[ix][iy + 1] = ((c0x1 + c0y0) / 2, (c1x1 + c1y0) / 2, (c2x1 + c2y0) / 2)
-                    else:
-                        continue
-                    pix[ix + 1][iy + 1] = ((c0x0 + c0y0) / 2, (c1x0 + c1y0) / 2, (c2x0 + c2y0) / 2)
-                else:
-                    # fake pixel AA
-                    pygame.draw.aaline(self.surface, pygame.Color(star.color[0], star.color[1], star.color[2]), (x - 0.5, y), (x + 0.5, y + 0.1))
-            else:
-                star.reset(self.camera)
-        if pix_anti_alias:
-            del pix
+            x = numpy.floor(x + .5).astype(int)
+            y = numpy.floor(y + .5).astype(int)
+        self.add_pixels(x, y, colors, surface)
+
+    def add_pixels(self, x, y, colors, surface = None):
+        '''Adds colors, an (n, 3) array, to the pixels (x[i], y[i]) of surface (the drawer's by default),
+        saturating at white. The colors of a pixel hit several times add up, pixels off the surface are left out.'''
+        if surface is None:
+            surface = self.surface
+        (w, h) = surface.get_size()
+        inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        if not inside.any():
+            return
+        index = x[inside] * h + y[inside]
+        colors = colors[inside]
+        pixels, inverse = numpy.unique(index, return_inverse = True)
+        sums = numpy.empty((len(pixels), 3))
+        for channel in xrange(0, 3):
+            sums[:, channel] = numpy.bincount(inverse, colors[:, channel], len(pixels))
+        x = pixels // h
+        y = pixels % h
+        pix = pygame.surfarray.pixels3d(surface)
+        sums += pix[x, y]
+        pix[x, y] = numpy.minimum(sums, 255)
+        del pix
 
     def draw_planet(self, planet):
         w = self.surf_planet1_small.get_width() * planet.size
@@ -112,39 +144,88 @@ class Drawer:
         sin = math.sin(rotation)
         pygame.draw.aaline(self.surface, color, (cos * x1 + sin * y1 + dx, cos * y1 - sin * x1 + dy), (cos * x2 + sin * y2 + dx, cos * y2 - sin * x2 + dy))
 
-    def draw_particles(self, particles):
-        pix = pygame.PixelArray(self.surface)
-        w = len(pix)
-        h = len(pix[0])
+    def draw_particles(self, particles, lag = .0, splat = False):
+        '''Draws the particles where they were lag seconds ago, all at once. Their colors add up with
+        what is beneath, fading out in their last second. If splat is True, every particle is spread
+        bilinearly over 2x2 pixels, which moves smoothly, else it lights the pixel it is in.'''
         off = self.camera.get_offset()
-        for particle in particles:
-            x = int(particle.position[0] + off[0])
-            y = int(particle.position[1] + off[1])
-            if x >= 0 and x < w and y >= 0 and y < h:
-                alpha = min(particle.ttl, 1)
-                col = pygame.Color(pix[x][y])
-                pix[x][y] = (min(int(col.r + particle.color[0] * alpha), 255),
-                    min(int(col.g + particle.color[1] * alpha), 255),
-                    min(int(col.b + particle.color[2] * alpha), 255))
-        del pix
+        n = particles.count
+        x = particles.position[:n, 0] - particles.speed[:n, 0] * lag + off[0]
+        y = particles.position[:n, 1] - particles.speed[:n, 1] * lag + off[1]
+        colors = particles.color[:n] * numpy.minimum(particles.ttl[:n], 1)[:, numpy.newaxis]
+        # pixel i reaches from i to i + 1, draw_points() takes the center
+        self.draw_points(x - .5, y - .5, colors, splat)
+
+    def draw_profiler(self, profiler, x = 1, y = 26, frames = 240, height = 100, ms = 50.0):
+        '''Draws a rolling graph of the last frames' times, stacked by phase, height pixels standing
+        for ms milliseconds, and next to it the mean and maximum of every phase over those frames.'''
+        phase_count = len(profiler.phases)
+        if self.profiler_graph is None:
+            self.profiler_graph = pygame.Surface((frames, height), 0, 32)
+            # a hue per phase, waiting is grey, the last entry is the background
+            colors = []
+            for i in xrange(0, phase_count):
+                color = pygame.Color(0, 0, 0)
+                color.hsva = (i * 360.0 / phase_count, 80, 100, 100)
+                colors.append(tuple(color)[:3])
+            colors[profiler.phases.index('wait')] = (64, 64, 64)
+            self.profiler_palette = numpy.array(colors + [(16, 16, 16)])
+        data, first = profiler.get_frames(frames)
+        # the top of every phase, stacked from the bottom, in pixels
+        tops = numpy.cumsum(data[:, 1:phase_count + 1], axis = 1) * (height / ms)
+        # per pixel the first phase whose top is above it
+        levels = numpy.arange(height - 1, -1, -1) + .5
+        phase = (tops[:, numpy.newaxis, :] <= levels[numpy.newaxis, :, numpy.newaxis]).sum(axis = 2)
+        pixels = numpy.empty((frames, height), dtype = int)
+        pixels.fill(phase_count)
+        pixels[frames - len(phase):] = phase
+        pygame.surfarray.blit_array(self.profiler_graph, self.profiler_palette[pixels])
+        # a tick at 60 fps
+        line = height - height / ms * 1000 / 60.0
+        pygame.draw.line(self.profiler_graph, self.col_white, (0, line), (frames - 1, line))
+        self.surface.blit(self.profiler_graph, (x, y))
+
+        # the legend only changes twice a second
+        if self.profiler_legend is None or profiler.frames - self.profiler_legend_frame >= 30:
+            self.profiler_legend_frame = profiler.frames
+            line_height = self.font_sans.get_linesize()
+            self.profiler_legend = pygame.Surface((480, line_height * (phase_count + 3)), 0, 32)
+            self.profiler_legend.set_colorkey(self.col_black)
+            phases = data[:, 1:phase_count + 1]
+            means = phases.mean(axis = 0) if len(phases) else numpy.zeros(phase_count)
+            maxima = phases.max(axis = 0) if len(phases) else numpy.zeros(phase_count)
+            for i, name in enumerate(profiler.phases):
+                color = pygame.Color(*self.profiler_palette[i].tolist())
+                self.profiler_legend.fill(color, (0, i * line_height + 3, 8, 8))
+                self.profiler_legend.blit(self.font_sans.render(name, True, color), (12, i * line_height))
+                self.profiler_legend.blit(self.font_sans.render('%6.2f %6.2f ms' % (means[i], maxima[i]), True, color), (150, i * line_height))
+            counts = data[-1, phase_count + 1:] if len(data) else numpy.zeros(len(profiler.counters))
+            text = ', '.join('%s %d' % (name, count) for name, count in zip(profiler.counters, counts.tolist()))
+            self.profiler_legend.blit(self.font_sans.render(text, True, self.col_white), (0, phase_count * line_height))
+            spike = profiler.get_spike()
+            if spike:
+                text = 'slowest: frame %d %.1f ms, %s %.1f ms' % spike
+                self.profiler_legend.blit(self.font_sans.render(text, True, self.col_white), (0, (phase_count + 1) * line_height))
+        self.surface.blit(self.profiler_legend, (x + frames + 8, y))
 
-    def draw_shot(self, shot):
+    def draw_shots(self, shots):
+        '''Draws the lines of a world.Shots, fading out in their last moments.'''
         off = self.camera.get_offset()
-        alpha = min(int(shot.ttl * 400.0), 255)
-        col = shot.origin.parts[0].shapes[0].color # shot color is the color of the first part's first shape of the originting spacecraft
-        engine.draw_line_alpha(self.surface, col,
-            (off[0] + shot.shapes[0].real_start[0], off[1] + shot.shapes[0].real_start[1]),
-            (off[0] + shot.shapes[0].real_end[0], off[1] + shot.shapes[0].real_end[1]), alpha)
+        n = shots.count
+        alpha = numpy.minimum(shots.ttl[:n] * 400.0, 255).astype(int).tolist()
+        for (x1, y1, x2, y2), color, a in zip(shots.lines[:n].tolist(), shots.color[:n].tolist(), alpha):
+            engine.draw_line_alpha(self.surface, color, (off[0] + x1, off[1] + y1), (off[0] + x2, off[1] + y2), a)
 
     def draw_spacecraft(self, spacecraft):
         off = self.camera.get_offset()
         for part in spacecraft.parts:
             for shape in part.shapes:
                 if isinstance(shape, world.Line):
-                    pygame.draw.aaline(self.surface, shape.color,
-                        (shape.real_start[0] + off[0], shape.real_start[1] + off[1]), (shape.real_end[0] + off[0], shape.real_end[1] + off[1]))
+                    x1, y1, x2, y2 = shape.real.tolist()
+                    pygame.draw.aaline(self.surface, shape.color, (x1 + off[0], y1 + off[1]), (x2 + off[0], y2 + off[1]))
                 if isinstance(shape, world.Circle):
-                    #pygame.draw.circle(self.surface, shape.color, (int(shape.real_center[0] + off[0]), int(shape.real_center[1] + off[1])), int(shape.radius), 1)
-                    engine.draw_aa_circle(self.surface, shape.color, (shape.real_center[0] + off[0], shape.real_center[1] + off[1]), int(shape.radius), 16)
+                    x, y = shape.real.tolist()
+                    #pygame.draw.circle(self.surface, shape.color, (int(x + off[0]), int(y + off[1])), int(shape.radius), 1)
+                    engine.draw_aa_circle(self.surface, shape.color, (x + off[0], y + off[1]), int(shape.radius), 16)
                 if isinstance(shape, world.Poly):
-                    pygame.draw.polygon(self.surface, shape.color, [[p[0] + off[0], p[1] + off[1]] for p in shape.real_pointlist], 0)
+                    pygame.draw.polygon(self.surface, shape.color, (shape.get_real_points() + off).tolist(), 0)
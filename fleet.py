@@ -0,0 +1,230 @@
+'''Batched kinematics and shape transformation for all spacecrafts of a world.'''
+
+import math
+import numpy
+import world
+
+class Fleet:
+    '''Processes a list of spacecrafts at once: steering, rotation, speed limit and movement are applied
+    to arrays holding the state of all spacecrafts, and the local points of all their shapes are kept in
+    one contiguous array and transformed in a single pass into a preallocated buffer. The real coordinates
+    of the shapes (shape.real) are views into that buffer.
+
+    Spacecrafts that neither moved nor turned since their last transformation and have no animated parts
+    keep their transformation. The layout is rebuilt whenever invalidate() has been called, that is when
+    spacecrafts are added or removed.
+
+    With a scheduler (see pilots.Scheduler) only the pilots it picks think, and piloted spacecrafts
+    keep steering the same way in between. Without one every pilot thinks every tick. Spacecrafts
+    whose fire flag is set, such as the player's, shoot into world right after the pilots.'''
+    def __init__(self, spacecrafts, scheduler = None, world = None):
+        self.spacecrafts = spacecrafts      # list owned by the world, the fleet reads it on rebuild
+        self.scheduler = scheduler
+        self.world = world
+        self.layout_dirty = True
+        self.interpolated = False
+
+    def invalidate(self):
+        self.layout_dirty = True
+
+    def rebuild(self):
+        '''Lays out the shapes of all spacecrafts in contiguous arrays and points them into the new buffer.'''
+        self.ships = list(self.spacecrafts)
+        self.parts = []
+        self.first_part = []    # index of every spacecraft's first part in self.parts
+        local = []
+        point_ship = []
+        part_offset = []
+        part_rotation = []
+        pad = []
+        part_start = []
+        self.views = []         # (shape, first point) for binding the real coordinates to the buffer
+        self.animated = []      # (first point, shape) of shapes in animated parts, their local points change
+        animated_ships = []
+        for i in xrange(0, len(self.ships)):
+            spacecraft = self.ships[i]
+            self.first_part.append(len(self.parts))
+            animated = False
+            for part in spacecraft.parts:
+                self.parts.append(part)
+                part_start.append(len(local))
+                for shape in part.shapes:
+                    p = len(local)
+                    points = shape.local.reshape((-1, 2)).tolist()
+                    radius = shape.radius if isinstance(shape, world.Circle) else 0
+                    local += points
+                    point_ship += [i] * len(points)
+                    part_offset += [part.position] * len(points)
+                    part_rotation += [part.rotation] * len(points)
+                    pad += [radius] * len(points)
+                    self.views.append((shape, p))
+                    if part.animator:
+                        self.animated.append((p, shape))
+                        animated = True
+            animated_ships.append(animated)
+        n = len(self.ships)
+        self.local = numpy.array(local, dtype = float).reshape((-1, 2))
+        self.point_ship = numpy.array(point_ship, dtype = int)
+        self.part_offset = numpy.array(part_offset, dtype = float).reshape((-1, 2))
+        part_rotation = numpy.array(part_rotation, dtype = float)
+        self.part_cos = numpy.cos(part_rotation)
+        self.part_sin = numpy.sin(part_rotation)
+        self.pad = numpy.array(pad, dtype = float)
+        self.part_start = numpy.array(part_start + [len(local)], dtype = int)
+        self.animated_ships = numpy.array(animated_ships, dtype = bool)
+        self.buffer = numpy.zeros((len(local), 2))
+        # bind the shapes' real coordinates to the buffer
+        flat = self.buffer.reshape(-1)
+        for shape, p in self.views:
+            shape.real = flat[p * 2:p * 2 + len(shape.local)]
+        # stats don't change while flying
+        self.accerlation = numpy.array([s.stats.accerlation for s in self.ships], dtype = float)
+        self.rotation_speed = numpy.array([s.stats.rotation_speed for s in self.ships], dtype = float)
+        self.speed_max = numpy.array([s.stats.speed_max for s in self.ships], dtype = float)
+        # state the shapes were transformed for, nan forces a transformation
+        self.transformed_position = numpy.empty((n, 2))
+        self.transformed_position.fill(numpy.nan)
+        self.transformed_rotation = numpy.empty(n)
+        self.transformed_rotation.fill(numpy.nan)
+        self.layout_dirty = False
+        self.interpolated = False
+
+    def process(self, timespan):
+        '''Pilots, steers, rotates and moves all spacecrafts, processes their parts and transforms their shapes.'''
+        # weapons shoot from their real coordinates: a rebuilt buffer is still empty, and rendering
+        # must not change the outcome of the simulation
+        if self.layout_dirty or self.interpolated:
+            self.transform()
+            self.interpolated = False
+        ships = self.ships
+        if self.scheduler:
+            self.scheduler.run()
+        else:
+            for spacecraft in ships:
+                if spacecraft.pilot and spacecraft.alive:
+                    spacecraft.pilot.pilot()
+        for spacecraft in ships:
+            if spacecraft.fire:
+                spacecraft.fire = False
+                if self.world and spacecraft.alive:
+                    spacecraft.shoot(self.world)
+        if not ships:
+            return
+        position = numpy.array([s.position for s in ships], dtype = float)
+        speed = numpy.array([s.speed for s in ships], dtype = float)
+        rotation = numpy.array([s.rotation for s in ships], dtype = float)
+        rotate_to = numpy.array([s.rotate_to for s in ships], dtype = float)
+        steer = numpy.array([s.steer for s in ships], dtype = float)
+        previous_position = position.tolist()
+        previous_rotation = rotation.tolist()
+        # steering: straight and back along the spacecraft's direction, left and right across it
+        cos = numpy.cos(rotation)
+        sin = numpy.sin(rotation)
+        acc = self.accerlation * timespan
+        forward = (steer[:, 0] - steer[:, 1]) * acc
+        sideways = (steer[:, 2] - steer[:, 3]) * acc
+        speed[:, 0] += forward * cos - sideways * sin
+        speed[:, 1] -= forward * sin + sideways * cos
+        # rotation
+        step = self.rotation_speed * timespan
+        diff = rotate_to - rotation
+        rotation = numpy.where(numpy.abs(diff) <= step, rotate_to, rotation + numpy.sign(diff) * step)
+        # respect the speed limit
+        length = numpy.sqrt(speed[:, 0]**2 + speed[:, 1]**2)
+        too_fast = length > self.speed_max
+        speed[too_fast] *= (self.speed_max[too_fast] / length[too_fast])[:, numpy.newaxis]
+        # move
+        position += speed * timespan
+        position_list = position.tolist()
+        speed_list = speed.tolist()
+        rotation_list = rotation.tolist()
+        for i in xrange(0, len(ships)):
+            spacecraft = ships[i]
+            spacecraft.previous_position = previous_position[i]
+            spacecraft.previous_rotation = previous_rotation[i]
+            spacecraft.position = position_list[i]
+            spacecraft.speed = speed_list[i]
+            spacecraft.rotation = rotation_list[i]
+            if not (spacecraft.pilot and self.scheduler):
+                spacecraft.steer = [False] * 4
+        for part in self.parts:
+            part.process(timespan)
+        self.transform(position, rotation)
+
+    def transform(self, position = None, rotation = None):
+        '''Transforms the shapes of all spacecrafts that moved, turned or are animated since their last
+        transformation, by default for their current position and rotation.'''
+        if self.layout_dirty:
+            self.rebuild()
+        if not self.ships:
+            return
+        if position is None:
+            position = numpy.array([s.position for s in self.ships], dtype = float)
+        if rotation is None:
+            rotation = numpy.array([s.rotation for s in self.ships], dtype = float)
+        dirty = self.animated_ships | (rotation != self.transformed_rotation) | \
+            (position[:, 0] != self.transformed_position[:, 0]) | (position[:, 1] != self.transformed_position[:, 1])
+        if not dirty.any():
+            return
+        self.transformed_position[dirty] = position[dirty]
+        self.transformed_rotation[dirty] = rotation[dirty]
+        # animators change local points
+        local_flat = self.local.reshape(-1)
+        for p, shape in self.animated:
+            local_flat[p * 2:p * 2 + len(shape.local)] = shape.local
+        points = numpy.flatnonzero(dirty[self.point_ship])
+        ship = self.point_ship[points]
+        cos = numpy.cos(rotation)[ship]
+        sin = numpy.sin(rotation)[ship]
+        offset = self.part_offset[points]
+        dx = position[ship, 0] + cos * offset[:, 0] + sin * offset[:, 1]
+        dy = position[ship, 1] + cos * offset[:, 1] - sin * offset[:, 0]
+        # rotation of the spacecraft plus the part's rotation
+        cos2 = cos * self.part_cos[points] - sin * self.part_sin[points]
+        sin2 = sin * self.part_cos[points] + cos * self.part_sin[points]
+        local = self.local[points]
+        self.buffer[points, 0] = cos2 * local[:, 0] + sin2 * local[:, 1] + dx
+        self.buffer[points, 1] = cos2 * local[:, 1] - sin2 * local[:, 0] + dy
+        self.update_bounds(numpy.flatnonzero(dirty))
+
+    def update_bounds(self, ship_indices):
+        '''Sets the bounding boxes of the given spacecrafts and their parts from the buffer.'''
+        starts = self.part_start[:-1]
+        filled = numpy.flatnonzero(self.part_start[1:] > starts)
+        if not len(filled):
+            return
+        s = starts[filled]
+        min_x = numpy.minimum.reduceat(self.buffer[:, 0] - self.pad, s)
+        min_y = numpy.minimum.reduceat(self.buffer[:, 1] - self.pad, s)
+        max_x = numpy.maximum.reduceat(self.buffer[:, 0] + self.pad, s)
+        max_y = numpy.maximum.reduceat(self.buffer[:, 1] + self.pad, s)
+        boxes = [None] * len(self.parts)
+        for j, box in zip(filled.tolist(), numpy.column_stack((min_x, min_y, max_x, max_y)).tolist()):
+            boxes[j] = tuple(box)
+        for i in ship_indices:
+            spacecraft = self.ships[i]
+            first = self.first_part[i]
+            for j in xrange(0, len(spacecraft.parts)):
+                spacecraft.parts[j].bounds = boxes[first + j]
+            spacecraft.bounds = world.merge_bounds(boxes[first:first + len(spacecraft.parts)])
+
+    def interpolate(self, alpha):
+        '''Transforms the shapes to the state in between the previous tick (alpha = 0) and the last one
+        (alpha = 1), for rendering. The real coordinates are transformed back in the next tick.'''
+        if self.layout_dirty:
+            self.rebuild()
+        ships = self.ships
+        if not ships:
+            return
+        position = numpy.array([s.position for s in ships], dtype = float)
+        rotation = numpy.array([s.rotation for s in ships], dtype = float)
+        previous_position = numpy.array([s.previous_position or s.position for s in ships], dtype = float)
+        previous_rotation = numpy.array([s.previous_rotation if s.previous_position else s.rotation for s in ships], dtype = float)
+        render_position = previous_position + (position - previous_position) * alpha
+        # turn the short way round
+        turn = (rotation - previous_rotation + math.pi) % (math.pi * 2) - math.pi
+        self.transform(render_position, previous_rotation + turn * alpha)
+        render_list = render_position.tolist()
+        for i in xrange(0, len(ships)):
+            ships[i].render_position = render_list[i]
+        self.interpolated = True
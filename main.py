@@ -1,18 +1,61 @@
 #!/usr/bin/env python
+'''Plays the game. Sessions can be recorded and replayed exactly, a replay runs as fast as it can:
 
+./main.py --record session.rec
+./main.py --replay session.rec              # with the display
+./main.py --replay session.rec --headless   # simulation only, reports the time per frame
+
+While playing, p shows the frame profiler, o dumps its last frames to profile-<time>.csv and .json.'''
+
+import os
+import argparse
 import pygame
 from pygame.locals import *
 import random
 import math
 import time
 import copy
+import numpy
 import lightning
 import world
 import drawing
 import engine
+import replay
+import profiler
+import allocations
+import collector
 
 
 SCREEN_SIZE = [1024, 700] # [1366, 768]
+SIM_RATE = 60.0         # simulation ticks per second
+SIM_STEPS_MAX = 5       # max. ticks per frame, the simulation slows down rather than spiral out of control
+FPS_MAX = 100           # 0 for unlocked
+
+parser = argparse.ArgumentParser(description = 'Spac0r, an awesome space sh00ta.')
+parser.add_argument('--record', metavar = 'FILE', help = 'record the session to FILE')
+parser.add_argument('--replay', metavar = 'FILE', help = 'replay the session recorded in FILE')
+parser.add_argument('--headless', action = 'store_true', help = 'replay without the display')
+parser.add_argument('--seed', type = int, help = 'random seed, by default a random one')
+parser.add_argument('--profile', metavar = 'FILE', help = 'dump the profile of the last frames to FILE (.csv or .json) at the end')
+parser.add_argument('--allocations', action = 'store_true', help = 'track allocations per frame and report the top allocators at the end (slow)')
+parser.add_argument('--frame-gc', action = 'store_true', help = 'collect garbage in the idle time of frames instead of whenever it is due')
+args = parser.parse_args()
+if args.headless and not args.replay:
+    parser.error('--headless only works with --replay')
+
+recorder = None
+player = None
+if args.replay:
+    player = replay.Player(args.replay)
+    seed = player.seed
+    SCREEN_SIZE = player.screen_size
+else:
+    seed = args.seed if args.seed is not None else random.randrange(0, 1 << 32)
+# the simulation is determined by the seed, the time passing and the input
+random.seed(seed)
+numpy.random.seed(seed)
+if args.headless:
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
 
 pygame.init()
 pygame.display.set_caption('Spac0r')
@@ -27,74 +70,134 @@ drawer = drawing.Drawer(surf_display, camera)
 mouse_pos = (SCREEN_SIZE[0] / 2, SCREEN_SIZE[1] / 2)
 key_pressed = [False for x in xrange(0, 512)]
 mouse_pressed = [False for x in xrange(0, 6)]
+if args.record:
+    recorder = replay.Recorder(args.record, seed, SCREEN_SIZE)
+
+def control_player():
+    '''Hands the current input to the player's spacecraft, once per simulation tick. It acts on it
+    within the tick, so it shoots from its simulated rather than its rendered position.'''
+    if key_pressed[K_w]:
+        w.player.steer_straight()
+    if key_pressed[K_s]:
+        w.player.steer_back()
+    if key_pressed[K_a]:
+        w.player.steer_left()
+    if key_pressed[K_d]:
+        w.player.steer_right()
+
+    if mouse_pressed[1]:
+        w.player.fire = True
 
+sim_timespan = 1.0 / SIM_RATE
+sim_accumulator = .0
 processing_tick = time.time()
+sim_times = []          # seconds the ticks of every frame took
+running = True
+frame_profiler = profiler.Profiler()
+show_profiler = False
+tracker = allocations.AllocationTracker() if args.allocations else None
+frame_collector = None
+if args.frame_gc:
+    frame_collector = collector.Collector()
+    frame_collector.start()
+    # the level has just been built, a safe point
+    frame_collector.collect(2)
+explosions = 0
+frame_start = time.time()
+
+while running:
+    if player:
+        frame = player.read_frame()
+        if frame is None:
+            break
+        frame_timespan, frame_events = frame
+    else:
+        current_time = time.time()
+        frame_timespan = current_time - processing_tick
+        processing_tick = current_time
+    if tracker:
+        tracker.start_frame()
 
-while True:
-    # calculate camera position and player rotation from mouse position
+    # player rotation from mouse position
     v = [mouse_pos[0] - SCREEN_SIZE[0] / 2.0, mouse_pos[1] - SCREEN_SIZE[1] / 2.0]
-    drawer.camera.position[0] = w.player.position[0] + v[0] * 0.9
-    drawer.camera.position[1] = w.player.position[1] + v[1] * 0.9
     w.player.rotate(math.atan2(-v[1], v[0]))
+    frame_profiler.lap('input')
 
-    # draw things that don't need to be processed further
-    surf_display.fill(drawer.col_black)
-    drawer.draw_background(w.background, False)     # True for perfect anti-alias, False for performance
-    for planet in w.planets:
-        drawer.draw_planet(planet)
-
-    # processing
-    current_time = time.time()
-    timespan = current_time - processing_tick
-    processing_tick = current_time
-    for mutable in w.mutable:
-        mutable.process(timespan)
-    # check if decayed
-    for decayable in w.decayable:
-        if decayable.ttl == 0:
-            w.remove_entity(decayable)
-    # collision detection
-    processed = []
-    for collidable1 in w.collidable:
-        processed.append(collidable1)
-        for collidable2 in w.collidable:
-            if not collidable2 in processed:
-                pos = world.collides(collidable1.shapes, collidable2.shapes)
-                if pos:
-                    if isinstance(collidable1, world.Spacecraft) and isinstance(collidable2, world.Shot):
-                        if not collidable2.origin == collidable1:
-                            w.spacecraft_hit_by_shot(collidable1, collidable2, pos)
-                    if isinstance(collidable1, world.Shot) and isinstance(collidable2, world.Spacecraft):
-                        if not collidable1.origin == collidable2:
-                            w.spacecraft_hit_by_shot(collidable2, collidable1, pos)
-    # check if spacecraft's still living
-    for spacecraft in w.spacecrafts:
-        if spacecraft.stats.hit_points <= 0:
-            spacecraft.explode(w)
-
-    # draw processed things
-    for spacecraft in w.spacecrafts:
-        drawer.draw_spacecraft(spacecraft)
-    for shot in w.shots:
-        drawer.draw_shot(shot)
-    drawer.draw_particles(w.particles)
-
-    drawer.draw_lens_flares()
-
-    # render fps and update display
-    surf_fps = drawer.font_sans.render('%.1f' % fps_clock.get_fps(), True, drawer.col_red)
-    surf_display.blit(surf_fps, (1, -2))
-    surf_info = drawer.font_sans.render('engine surfaces: ' + str(len(engine.surf_alpha) + len(engine.surf_scale)), True, drawer.col_red)
-    surf_display.blit(surf_info, (1, 10))
-    pygame.display.update()
+    # processing in fixed ticks
+    sim_start = time.time()
+    sim_accumulator += frame_timespan
+    steps = 0
+    while sim_accumulator >= sim_timespan:
+        if steps == SIM_STEPS_MAX:
+            sim_accumulator = .0
+            break
+        control_player()
+        w.process(sim_timespan, frame_profiler)
+        sim_accumulator -= sim_timespan
+        steps += 1
+    sim_times.append(time.time() - sim_start)
+    # render in between the last two ticks
+    w.interpolate(sim_accumulator / sim_timespan, sim_timespan)
+    frame_profiler.lap('interpolate')
+
+    if not args.headless:
+        # calculate camera position from mouse position
+        drawer.camera.position[0] = w.player.render_position[0] + v[0] * 0.9
+        drawer.camera.position[1] = w.player.render_position[1] + v[1] * 0.9
+
+        # draw things that don't need to be processed further
+        surf_display.fill(drawer.col_black)
+        drawer.draw_background(w.background, True)      # True for bilinear anti-alias, False for nearest pixels
+        frame_profiler.lap('draw_background')
+        for planet in w.planets:
+            drawer.draw_planet(planet)
+        frame_profiler.lap('draw_planets')
+
+        # draw processed things
+        for spacecraft in w.spacecrafts:
+            drawer.draw_spacecraft(spacecraft)
+        frame_profiler.lap('draw_spacecrafts')
+        drawer.draw_shots(w.shots)
+        frame_profiler.lap('draw_shots')
+        drawer.draw_particles(w.particles, w.render_lag)
+        frame_profiler.lap('draw_particles')
+
+        drawer.draw_lens_flares()
+        frame_profiler.lap('draw_lens_flares')
+
+        # render fps and update display
+        surf_fps = drawer.font_sans.render('%.1f' % fps_clock.get_fps(), True, drawer.col_red)
+        surf_display.blit(surf_fps, (1, -2))
+        surf_info = drawer.font_sans.render('engine surfaces: ' + str(len(engine.surf_alpha) + len(engine.surf_scale)), True, drawer.col_red)
+        surf_display.blit(surf_info, (1, 10))
+        if show_profiler:
+            drawer.draw_profiler(frame_profiler)
+        frame_profiler.lap('draw_profiler')
+        pygame.display.update()
+        frame_profiler.lap('display_update')
 
     # events
-    for event in pygame.event.get():
+    if player:
+        events = frame_events
+        # closing the window stops the replay
+        for event in pygame.event.get():
+            running = running and event.type != QUIT
+    else:
+        events = pygame.event.get()
+    if recorder:
+        recorder.write_frame(frame_timespan, events, sim_times[-1])
+    for event in events:
         if event.type == QUIT or (event.type == KEYDOWN and event.key == K_q):
-            pygame.quit()
-            exit(0)
+            running = False
         if event.type == KEYDOWN:
             key_pressed[event.key] = True
+            if event.key == K_p:
+                show_profiler = not show_profiler
+            if event.key == K_o:
+                path = time.strftime('profile-%Y%m%d-%H%M%S')
+                frame_profiler.dump(path + '.csv')
+                frame_profiler.dump(path + '.json')
+                print 'profile of the last %d frames written to %s.csv and .json' % (len(frame_profiler.get_frames()[0]), path)
         if event.type == KEYUP:
             key_pressed[event.key] = False
         if event.type == MOUSEMOTION:
@@ -103,17 +206,52 @@ while True:
             mouse_pressed[event.button] = True
         if event.type == MOUSEBUTTONUP:
             mouse_pressed[event.button] = False
-    # controls
-    if key_pressed[K_w]:
-        w.player.steer_straight()
-    if key_pressed[K_s]:
-        w.player.steer_back()
-    if key_pressed[K_a]:
-        w.player.steer_left()
-    if key_pressed[K_d]:
-        w.player.steer_right()
 
-    if mouse_pressed[1]:
-        w.player.shoot(w)
+    frame_profiler.lap('input')
+
+    # collect garbage while waiting anyway, explosions hide the pause of a full collection
+    if frame_collector:
+        if w.explosions != explosions:
+            explosions = w.explosions
+            frame_collector.request_full()
+        idle_time = 1.0 / FPS_MAX - (time.time() - frame_start) if FPS_MAX and not player else 0
+        frame_profiler.count('collections', frame_collector.idle(idle_time))
+    frame_profiler.lap('gc')
+
+    # replays run as fast as they can
+    fps_clock.tick(0 if player else FPS_MAX)
+    frame_start = time.time()
+    frame_profiler.lap('wait')
+    frame_profiler.count('spacecrafts', len(w.spacecrafts))
+    frame_profiler.count('shots', len(w.shots))
+    frame_profiler.count('particles', len(w.particles))
+    frame_profiler.end_frame()
+    if tracker:
+        tracker.end_frame()
 
-    fps_clock.tick(100)
+if recorder:
+    recorder.close(w)
+if args.profile:
+    frame_profiler.dump(args.profile)
+if tracker:
+    print tracker.get_report()
+if frame_collector:
+    frame_collector.stop()
+    print frame_collector.get_report()
+pygame.quit()
+if player:
+    # the checksum follows the last frame
+    while player.read_frame():
+        pass
+    player.close()
+    print 'replayed %d frames, %.2f s of simulation' % (len(sim_times), w.time)
+    print 'simulation per frame   %8.3f ms mean %8.3f ms 99%% %8.3f ms max (frame %d)' % replay.get_summary(sim_times)
+    print 'recorded               %8.3f ms mean %8.3f ms 99%% %8.3f ms max (frame %d)' % replay.get_summary(player.sim_times)
+    checksum = replay.get_checksum(w)
+    if player.checksum is None:
+        print 'the recording is cut off, world checksum %08x' % checksum
+    elif player.checksum != checksum:
+        print 'the replay went differently: world checksum %08x, recorded %08x' % (checksum, player.checksum)
+        exit(1)
+    else:
+        print 'the replay went the same way, world checksum %08x' % checksum
@@ -1,18 +1,130 @@
 import world
 import math
+import heapq
+
+class Scheduler:
+    '''Lets pilots think at a think rate instead of every tick. A pilot thinks think_rate times per
+    second, or engaged_rate times while it is engaged: its spacecraft is within engaged_distance
+    of the player or has been hit within the last engaged_time seconds. Pilots are spread evenly
+    across ticks and at most budget pilots think per tick (None for no limit), the rest are late.
+    In between, spacecrafts keep the steering their pilot decided on, and firing pilots shoot
+    every tick. Only the pilots that think cost time, so AI cost grows with the think rate rather
+    than with the number of spacecrafts.'''
+    def __init__(self, world, think_rate = 10.0, engaged_rate = 20.0, engaged_distance = 400.0, engaged_time = 2.0, budget = None):
+        self.world = world
+        self.think_rate = think_rate
+        self.engaged_rate = engaged_rate
+        self.engaged_distance = engaged_distance
+        self.engaged_time = engaged_time
+        self.budget = budget
+        self.queue = []         # heap of (next think time, order, pilot)
+        self.order = 0          # pilots added so far, breaks ties and spreads them
+        self.pilots = []        # in the order they were added
+        self.firing = []        # pilots whose last decision was to shoot
+        self.firing_dirty = False
+        self.thinks = 0         # pilots that thought in the last tick
+
+    def add(self, pilot):
+        '''Schedules a pilot, its first thought is at pilot.next_think if set, otherwise somewhere
+        within the next interval.'''
+        self.order += 1
+        if pilot.next_think is None:
+            # golden ratio steps spread any number of pilots evenly over the interval
+            pilot.next_think = self.world.time + self.get_interval(pilot) * (self.order * .618034 % 1)
+        heapq.heappush(self.queue, (pilot.next_think, self.order, pilot))
+        self.pilots.append(pilot)
+        if pilot.firing:
+            self.firing_dirty = True
+
+    def get_interval(self, pilot):
+        spacecraft = pilot.spacecraft
+        player = self.world.player
+        engaged = spacecraft.hit_time is not None and self.world.time - spacecraft.hit_time <= self.engaged_time
+        if not engaged and player and player is not spacecraft:
+            dx = player.position[0] - spacecraft.position[0]
+            dy = player.position[1] - spacecraft.position[1]
+            engaged = dx**2 + dy**2 <= self.engaged_distance**2
+        return 1.0 / (self.engaged_rate if engaged else self.think_rate)
+
+    def run(self):
+        '''Lets the pilots that are due think, then the firing ones shoot.'''
+        now = self.world.time
+        queue = self.queue
+        due = []
+        while queue and queue[0][0] <= now and (self.budget is None or len(due) < self.budget):
+            next_think, order, pilot = heapq.heappop(queue)
+            if not pilot.spacecraft.alive or pilot.spacecraft.pilot is not pilot:
+                self.firing_dirty = True
+                continue
+            due.append((next_think, order, pilot))
+        self.thinks = len(due)
+        if due:
+            # the enemies of all pilots in one query
+            spacecrafts = [pilot.spacecraft for next_think, order, pilot in due]
+            enemies = self.world.find_nearest_batch([s.position for s in spacecrafts], max(x[2].enemy_count for x in due),
+                [world.get_enemy_factions(s.faction) for s in spacecrafts], spacecrafts)
+            for (next_think, order, pilot), found in zip(due, enemies):
+                pilot.set_enemies(found[:pilot.enemy_count])
+                firing = pilot.firing
+                pilot.think()
+                if pilot.firing != firing:
+                    self.firing_dirty = True
+                next_think += self.get_interval(pilot)
+                if next_think <= now:
+                    next_think = now + self.get_interval(pilot)
+                pilot.next_think = next_think
+                heapq.heappush(queue, (next_think, order, pilot))
+        self.shoot()
+
+    def shoot(self):
+        '''Lets the firing pilots shoot.'''
+        if self.firing_dirty:
+            self.pilots = filter(lambda x: x.spacecraft.alive and x.spacecraft.pilot is x, self.pilots)
+            self.firing = filter(lambda x: x.firing, self.pilots)
+            self.firing_dirty = False
+        for pilot in self.firing:
+            if pilot.spacecraft.alive:
+                pilot.spacecraft.shoot(self.world)
 
 class AI_Pilot:
+    '''think() decides how to steer, which is kept in spacecraft.steer until the next thought, and
+    whether to fire. Before, the enemy_count nearest enemies are looked up and the nearest one
+    becomes the target. pilot() does all of it at once, for spacecrafts processed without a scheduler.'''
+    enemy_count = 3
+
     def __init__(self, spacecraft, world):
         self.spacecraft = spacecraft
         self.world = world
+        self.enemies = []       # nearest first
+        self.target = None
+        self.firing = False
+        self.next_think = None  # world time, kept by the scheduler
+
+    def set_enemies(self, enemies):
+        self.enemies = enemies
+        self.target = enemies[0] if enemies else None
+
+    def pilot(self):
+        self.set_enemies(self.world.find_nearest(self.spacecraft.position, self.enemy_count,
+            world.get_enemy_factions(self.spacecraft.faction), self.spacecraft))
+        self.think()
+        if self.firing:
+            self.spacecraft.shoot(self.world)
+
+    def think(self):
+        pass
 
 class AI_Pilot_Basic(AI_Pilot):
+    '''Keeps its target in shooting range and dodges nearby enemies that aim at it.'''
+    threat_distance = 250.0     # enemies closer than this are threats if they aim at us
+    threat_angle = .2           # how many radians an enemy may aim off
+
     def __init__(self, spacecraft, world):
         AI_Pilot.__init__(self, spacecraft, world)
         # look up weapon with highest dps
         self.strongest_weapon = None
         dps_max = 0
-        for part in filter(lambda x: x.stats.attack > 0, spacecraft.parts):
+        for part in spacecraft.weapons:
             dps = part.stats.attack / float(part.stats.attack_cooldown_max)
             if dps > dps_max:
                 self.strongest_weapon = part
@@ -24,26 +136,53 @@ class AI_Pilot_Basic(AI_Pilot):
             self.shooting_range = 0
             self.optimal_distance = 350
 
-    def pilot(self):
-        # face player
-        dx = self.world.player.position[0] - self.spacecraft.position[0]
-        dy = self.spacecraft.position[1] - self.world.player.position[1]
-        angle_to_player = math.atan2(dy, dx)
-        self.spacecraft.rotate(angle_to_player)
+    def think(self):
+        self.spacecraft.steer = [False] * 4
+        self.firing = False
+        target = self.target
+        if not target:
+            return
+        # face target
+        dx = target.position[0] - self.spacecraft.position[0]
+        dy = self.spacecraft.position[1] - target.position[1]
+        angle_to_target = math.atan2(dy, dx)
+        self.spacecraft.rotate(angle_to_target)
         # catch up
-        dist_to_player = math.sqrt(dx**2 + dy**2)
-        if dist_to_player > self.optimal_distance:
+        dist_to_target = math.sqrt(dx**2 + dy**2)
+        if dist_to_target > self.optimal_distance:
             self.spacecraft.steer_straight()
-        elif dist_to_player < self.optimal_distance * 0.85:
+        elif dist_to_target < self.optimal_distance * 0.85:
             self.spacecraft.steer_back()
         # correct drifting
-        speed_diff = [self.world.player.speed[0] - self.spacecraft.speed[0], self.spacecraft.speed[1] - self.world.player.speed[1]]
+        speed_diff = [target.speed[0] - self.spacecraft.speed[0], self.spacecraft.speed[1] - target.speed[1]]
         sd_angle = math.atan2(speed_diff[1], speed_diff[0]) - self.spacecraft.rotation
         if abs(math.cos(sd_angle)) < .5:
             if math.sin(sd_angle) > 0:
                 self.spacecraft.steer_left()
             else:
                 self.spacecraft.steer_right()
+        self.dodge()
         # shoot
-        if dist_to_player <= self.shooting_range:
-            self.spacecraft.shoot(self.world)
+        self.firing = dist_to_target <= self.shooting_range
+
+    def dodge(self):
+        '''Steers sideways, out of the line of fire of the nearest enemy that aims at us.'''
+        position = self.spacecraft.position
+        for enemy in self.enemies:
+            # our offset from the enemy's line of fire
+            aim = (math.cos(enemy.rotation), -math.sin(enemy.rotation))
+            rel = (position[0] - enemy.position[0], position[1] - enemy.position[1])
+            dist = math.sqrt(rel[0]**2 + rel[1]**2)
+            if dist > self.threat_distance:
+                return
+            along = rel[0] * aim[0] + rel[1] * aim[1]
+            if along < dist * math.cos(self.threat_angle):
+                continue
+            perp = (rel[0] - along * aim[0], rel[1] - along * aim[1])
+            # left of our own direction is (-sin, -cos)
+            self.spacecraft.steer[2] = self.spacecraft.steer[3] = False
+            if perp[0] * -math.sin(self.spacecraft.rotation) - perp[1] * math.cos(self.spacecraft.rotation) >= 0:
+                self.spacecraft.steer_left()
+            else:
+                self.spacecraft.steer_right()
+            return
@@ -0,0 +1,79 @@
+'''Frame profiler: times the phases of every frame and keeps the last frames in a ring buffer.
+
+Phases are timed by laps: lap(phase) books the time since the previous lap on phase, so every
+moment of a frame belongs to some phase and the phases add up to the frame time. Counters hold
+per frame numbers such as entities or narrow phase tests. The buffer can be dumped as CSV or JSON.'''
+
+import csv
+import json
+import time
+import numpy
+
+# phases in the order of a frame in main.py
+PHASES = ['input', 'process', 'decay', 'collision', 'explosions', 'flush', 'interpolate', 'draw_background', 'draw_planets',
+    'draw_spacecrafts', 'draw_shots', 'draw_particles', 'draw_lens_flares', 'draw_profiler', 'display_update', 'gc', 'wait']
+COUNTERS = ['ticks', 'spacecrafts', 'shots', 'particles', 'pairs', 'pairs_skipped', 'narrow_phase', 'collections']
+
+class Profiler:
+    def __init__(self, size = 600, phases = PHASES, counters = COUNTERS):
+        self.phases = phases
+        self.counters = counters
+        self.columns = ['frame_ms'] + phases + counters
+        self.indices = dict((column, i) for i, column in enumerate(self.columns))
+        self.buffer = numpy.zeros((size, len(self.columns)))
+        self.frames = 0         # frames ended so far, the last ones are in the buffer
+        self.row = [.0] * len(self.columns)
+        self.lap_time = time.time()
+
+    def lap(self, phase):
+        '''Books the time since the previous lap on phase.'''
+        now = time.time()
+        self.row[self.indices[phase]] += (now - self.lap_time) * 1000
+        self.lap_time = now
+
+    def count(self, counter, value = 1):
+        self.row[self.indices[counter]] += value
+
+    def end_frame(self):
+        '''Stores the current frame in the buffer and starts the next one.'''
+        row = self.row
+        row[0] = sum(row[1:len(self.phases) + 1])
+        self.buffer[self.frames % len(self.buffer)] = row
+        self.frames += 1
+        self.row = [.0] * len(self.columns)
+
+    def get_frames(self, count = None):
+        '''Returns the last count buffered frames (all by default), oldest first, one row each
+        of the values in columns, and the number of the first of them.'''
+        size = len(self.buffer)
+        count = min(self.frames, size if count is None else count)
+        end = self.frames % size
+        indices = numpy.arange(end - count, end) % size
+        return self.buffer[indices], self.frames - count
+
+    def get_column(self, frames, column):
+        return frames[:, self.indices[column]]
+
+    def get_spike(self):
+        '''Returns (frame number, frame ms, slowest phase, its ms) of the slowest buffered frame, or None.'''
+        frames, first = self.get_frames()
+        if not len(frames):
+            return None
+        i = int(frames[:, 0].argmax())
+        phases = frames[i, 1:len(self.phases) + 1]
+        j = int(phases.argmax())
+        return first + i, frames[i, 0], self.phases[j], phases[j]
+
+    def dump(self, path):
+        '''Writes the buffered frames to path, as JSON if it ends with .json, else as CSV.'''
+        frames, first = self.get_frames()
+        with open(path, 'wb') as f:
+            if path.endswith('.json'):
+                json.dump({'phases': self.phases, 'counters': self.counters,
+                    'frames': [dict(zip(['frame'] + self.columns, [first + i] + row)) for i, row in enumerate(frames.tolist())]}, f, indent = 1)
+            else:
+                writer = csv.writer(f)
+                writer.writerow(['frame'] + self.columns)
+                n = len(self.phases) + 1
+                for i, row in enumerate(frames.tolist()):
+                    writer.writerow([first + i] + ['%.4f' % x for x in row[:n]] + ['%d' % x for x in row[n:]])
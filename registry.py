@@ -0,0 +1,56 @@
+'''Entity bookkeeping.'''
+
+class Registry:
+    '''Keeps entities in dense lists, one per category. Every entity gets a stable integer handle.
+    Removing is deferred: kill() queues an entity and flush() swap-removes all queued entities at
+    once, so the lists can be iterated safely while entities die. Adding and removing take constant
+    time per category; the order of a list changes when entities are removed.'''
+    def __init__(self, categories):
+        self.lists = dict((category, []) for category in categories)
+        self.indices = dict((category, {}) for category in categories)     # category -> {handle: index}
+        self.entities = {}      # handle -> entity
+        self.categories = {}    # handle -> categories of the entity
+        self.kill_queue = []
+        self.next_handle = 0
+
+    def add(self, entity, categories):
+        '''Adds entity to the lists of the given categories and returns its handle.'''
+        handle = self.next_handle
+        self.next_handle += 1
+        entity.handle = handle
+        entity.alive = True
+        self.entities[handle] = entity
+        self.categories[handle] = categories
+        for category in categories:
+            lst = self.lists[category]
+            self.indices[category][handle] = len(lst)
+            lst.append(entity)
+        return handle
+
+    def get(self, handle):
+        '''Returns the entity of a handle, or None if it has been removed.'''
+        return self.entities.get(handle)
+
+    def kill(self, entity):
+        '''Marks entity as dead and queues it for removal at the next flush().'''
+        if entity.alive:
+            entity.alive = False
+            self.kill_queue.append(entity)
+
+    def flush(self):
+        '''Removes all queued entities and returns them.'''
+        killed = self.kill_queue
+        self.kill_queue = []
+        for entity in killed:
+            handle = entity.handle
+            del self.entities[handle]
+            for category in self.categories.pop(handle):
+                lst = self.lists[category]
+                indices = self.indices[category]
+                index = indices.pop(handle)
+                last = lst.pop()
+                # move the last entity into the gap
+                if index < len(lst):
+                    lst[index] = last
+                    indices[last.handle] = index
+        return killed
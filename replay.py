@@ -0,0 +1,119 @@
+'''Recording and replaying sessions of main.py.
+
+A recording holds the random seed and, for every frame, the time that passed (which decides how many
+ticks the frame simulates), the input events the frame consumed and how long its ticks took to
+simulate. Fed the same seed, times and events, the simulation runs exactly the same way, so a
+replay reproduces a session tick for tick, with or without the display, and as fast as it can.
+The recording ends with a checksum of the world that the replay is compared against.
+
+The file is gzipped: a header (magic, version, seed, screen size) followed by one record per frame,
+each a frame header (time passed, simulation milliseconds, number of events) and its events.'''
+
+import gzip
+import struct
+import zlib
+import numpy
+import pygame
+from pygame.locals import *
+
+MAGIC = 'SPR0'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHIHH')    # magic, version, seed, screen width and height
+FRAME = struct.Struct('<dfH')       # seconds passed, simulation milliseconds, number of events
+EVENT = struct.Struct('<Bii')       # index in EVENT_TYPES, two values depending on the type
+CHECKSUM = struct.Struct('<I')
+END = 0xffff                        # number of events of the last record, followed by the checksum
+
+# the events main.py consumes, stored by their index so recordings don't depend on pygame's numbering
+EVENT_TYPES = [QUIT, KEYDOWN, KEYUP, MOUSEMOTION, MOUSEBUTTONDOWN, MOUSEBUTTONUP]
+
+def encode_event(event):
+    if event.type in (KEYDOWN, KEYUP):
+        values = (event.key, 0)
+    elif event.type == MOUSEMOTION:
+        values = event.pos
+    elif event.type in (MOUSEBUTTONDOWN, MOUSEBUTTONUP):
+        values = (event.button, 0)
+    else:
+        values = (0, 0)
+    return EVENT.pack(EVENT_TYPES.index(event.type), values[0], values[1])
+
+def decode_event(data):
+    index, a, b = EVENT.unpack(data)
+    event_type = EVENT_TYPES[index]
+    if event_type in (KEYDOWN, KEYUP):
+        return pygame.event.Event(event_type, key = a)
+    if event_type == MOUSEMOTION:
+        return pygame.event.Event(event_type, pos = (a, b))
+    if event_type in (MOUSEBUTTONDOWN, MOUSEBUTTONUP):
+        return pygame.event.Event(event_type, button = a)
+    return pygame.event.Event(event_type)
+
+def get_checksum(w):
+    '''Returns a checksum of the simulation state of world w, to tell whether two runs went the same way.'''
+    state = numpy.array([[s.position[0], s.position[1], s.rotation, s.hit_points, s.shield_points] for s in w.spacecrafts] +
+        [[w.time, len(w.spacecrafts), w.shots.count, w.particles.count, 0]])
+    shots = w.shots
+    n = shots.count
+    shot_state = numpy.hstack((shots.position[:n], shots.ttl[:n, numpy.newaxis], shots.attack[:n, numpy.newaxis]))
+    p = w.particles
+    return zlib.crc32(state.tobytes() + shot_state.tobytes() + p.position[:p.count].tobytes()) & 0xffffffff
+
+class Recorder:
+    '''Writes a recording frame by frame, call close() with the world at the end.'''
+    def __init__(self, path, seed, screen_size):
+        self.file = gzip.open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, screen_size[0], screen_size[1]))
+
+    def write_frame(self, timespan, events, sim_time):
+        '''Records a frame: the seconds that passed, the events it consumed and the seconds its ticks took.'''
+        events = [encode_event(event) for event in events if event.type in EVENT_TYPES]
+        self.file.write(FRAME.pack(timespan, sim_time * 1000, len(events)) + ''.join(events))
+
+    def close(self, w):
+        self.file.write(FRAME.pack(0, 0, END) + CHECKSUM.pack(get_checksum(w)))
+        self.file.close()
+
+class Player:
+    '''Reads a recording frame by frame. checksum is set once the end has been read, it stays None
+    if the recording was cut off.'''
+    def __init__(self, path):
+        self.file = gzip.open(path, 'rb')
+        magic, version, self.seed, width, height = HEADER.unpack(self.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('not a recording: bad magic %r' % magic)
+        if version > VERSION:
+            raise ValueError('recording version %d is newer than %d' % (version, VERSION))
+        self.screen_size = [width, height]
+        self.checksum = None
+        self.sim_times = []     # recorded seconds of simulation per frame
+
+    def read(self, size):
+        data = self.file.read(size)
+        if len(data) < size:
+            raise EOFError
+        return data
+
+    def read_frame(self):
+        '''Returns (seconds passed, events) of the next frame, or None at the end.'''
+        try:
+            timespan, sim_ms, count = FRAME.unpack(self.read(FRAME.size))
+            if count == END:
+                self.checksum = CHECKSUM.unpack(self.read(CHECKSUM.size))[0]
+                return None
+            data = self.read(EVENT.size * count)
+        except EOFError:
+            return None
+        self.sim_times.append(sim_ms / 1000.0)
+        return timespan, [decode_event(data[i:i + EVENT.size]) for i in xrange(0, len(data), EVENT.size)]
+
+    def close(self):
+        self.file.close()
+
+def get_summary(times):
+    '''Returns mean, 99th percentile and maximum of a list of seconds, in milliseconds, and the index of the maximum.'''
+    if not times:
+        return .0, .0, .0, -1
+    ms = numpy.array(times) * 1000
+    return ms.mean(), numpy.percentile(ms, 99), ms.max(), int(ms.argmax())
@@ -0,0 +1,349 @@
+'''Sharded world simulation for very large battles. The world is split into vertical strips, the
+shards, each simulated by its own worker process: movement, pilots, decay and collisions. Shards
+exchange migrating entities, ghosts and damage with their neighbours every tick, and the main
+process merges their snapshots into a View for rendering.
+
+    sharded = shards.ShardedWorld(screen_size, 4)
+    sharded.add_entity(spacecraft)
+    sharded.process(timespan)
+    drawer.draw_spacecraft(sharded.view.spacecrafts[0])
+    sharded.close()'''
+
+import multiprocessing
+import random
+import numpy
+import world
+import fleet
+import pilots
+
+INFINITY = float('inf')
+
+def get_empty_message():
+    '''Returns what a shard sends a neighbour when nothing crosses the border.'''
+    return {'spacecrafts': [], 'ghosts': [], 'shots': [], 'damage': []}
+
+# states are plain tuples, they travel between processes
+def get_spacecraft_state(spacecraft, piloted = None):
+    '''piloted tells whether the spacecraft gets a pilot where it is built, by default if it has one.'''
+    if piloted is None:
+        piloted = spacecraft.pilot is not None
+    return (spacecraft.uid, spacecraft.blueprint.name, spacecraft.faction, spacecraft.position[:], spacecraft.speed[:],
+        spacecraft.rotation, spacecraft.rotate_to, spacecraft.hit_points, spacecraft.hit_time,
+        [part.attack_cooldown for part in spacecraft.parts], piloted)
+
+def build_spacecraft(state, w, piloted = True):
+    '''Spawns a spacecraft from its state, with a pilot for w if it had one and piloted is True.'''
+    uid, name, faction, position, speed, rotation, rotate_to, hit_points, hit_time, cooldowns, pilot = state
+    spacecraft = world.blueprints[name].spawn()
+    spacecraft.uid = uid
+    spacecraft.faction = faction
+    set_spacecraft_state(spacecraft, state)
+    spacecraft.hit_points = hit_points
+    spacecraft.hit_time = hit_time
+    for part, cooldown in zip(spacecraft.parts, cooldowns):
+        part.attack_cooldown = cooldown
+    if pilot and piloted:
+        spacecraft.pilot = pilots.AI_Pilot_Basic(spacecraft, w)
+    return spacecraft
+
+def set_spacecraft_state(spacecraft, state):
+    '''Sets the transform of a spacecraft, which is all that changes for ghosts.'''
+    spacecraft.position = list(state[3])
+    spacecraft.speed = list(state[4])
+    spacecraft.rotation = state[5]
+    spacecraft.rotate_to = state[6]
+
+# a shot may outlive its origin or leave it behind in another shard, then its origin in world.Shots
+# is -2 - uid, which never matches a handle
+def get_absent_origin(uid):
+    return -2 - uid if uid >= 0 else -1
+
+def get_shot_states(w, indices):
+    '''Returns the states of the shots with the given indices in w.shots.'''
+    shots = w.shots
+    states = []
+    for i in indices:
+        origin = int(shots.origin[i])
+        spacecraft = w.entities.get(origin) if origin >= 0 else None
+        uid = spacecraft.uid if spacecraft else (-2 - origin if origin <= -2 else -1)
+        x, y = shots.position[i].tolist()
+        sx, sy = shots.speed[i].tolist()
+        states.append((float(shots.attack[i]), float(shots.ttl[i]), uid, tuple(shots.color[i].tolist()), x, y, sx, sy, int(shots.faction[i])))
+    return states
+
+class Shard:
+    '''The strip left <= x < right of the world. It owns the spacecrafts and shots within and keeps
+    ghosts of the neighbours' spacecrafts within margin of its borders: copies without pilots that
+    pilots can target and shots can hit. Damage to ghosts is sent to the shard owning the spacecraft.'''
+    def __init__(self, left, right, margin, screen_size):
+        self.left = left
+        self.right = right
+        self.margin = margin
+        self.world = world.World(screen_size, False, False)
+        self.owned = {}     # uid -> spacecraft
+        self.ghosts = {}    # uid -> (spacecraft, side it came from: -1 left, 1 right)
+
+    def get_spacecraft(self, uid):
+        if uid in self.owned:
+            return self.owned[uid]
+        ghost = self.ghosts.get(uid)
+        return ghost[0] if ghost else None
+
+    def add_spacecraft(self, state):
+        ghost = self.ghosts.pop(state[0], None)
+        if ghost:
+            self.remove_spacecraft(ghost[0])
+        spacecraft = build_spacecraft(state, self.world)
+        self.owned[spacecraft.uid] = spacecraft
+        self.add_entity(spacecraft)
+
+    def add_entity(self, spacecraft):
+        '''Adds spacecraft to the world and gives it back the shots it fired.'''
+        self.world.add_entity(spacecraft)
+        shots = self.world.shots
+        origin = shots.origin[:shots.count]
+        origin[origin == get_absent_origin(spacecraft.uid)] = spacecraft.handle
+
+    def remove_spacecraft(self, spacecraft):
+        '''Removes spacecraft from the world, its shots remember its uid.'''
+        shots = self.world.shots
+        origin = shots.origin[:shots.count]
+        origin[origin == spacecraft.handle] = get_absent_origin(spacecraft.uid)
+        self.world.remove_entity(spacecraft)
+
+    def receive(self, side, message):
+        '''Takes in what the neighbour on side (-1 left, 1 right) sent after its last tick.'''
+        w = self.world
+        for uid, damage in message['damage']:
+            spacecraft = self.owned.get(uid)
+            if spacecraft and spacecraft.alive:
+                spacecraft.hit_points -= damage
+                spacecraft.hit_time = w.time
+        for state in message['spacecrafts']:
+            self.add_spacecraft(state)
+        seen = set()
+        for state in message['ghosts']:
+            uid = state[0]
+            if uid in self.owned:
+                continue
+            seen.add(uid)
+            if uid in self.ghosts:
+                ghost = self.ghosts[uid][0]
+                set_spacecraft_state(ghost, state)
+            else:
+                ghost = build_spacecraft(state, w, False)
+                self.ghosts[uid] = (ghost, side)
+                self.add_entity(ghost)
+            # damage is what the shots of this shard take off, see tick()
+            ghost.hit_points = ghost.ghost_hit_points = state[7]
+        # ghosts that left the border area or died
+        for uid, (ghost, ghost_side) in self.ghosts.items():
+            if ghost_side == side and not uid in seen:
+                self.remove_spacecraft(ghost)
+                del self.ghosts[uid]
+        for attack, ttl, origin_uid, color, x, y, sx, sy, faction in message['shots']:
+            origin = self.get_spacecraft(origin_uid)
+            w.shots.add(attack, ttl, origin.handle if origin else get_absent_origin(origin_uid), color, x, y, sx, sy, faction)
+
+    def tick(self, timespan, messages):
+        '''Advances the shard by timespan seconds. messages are {side: message} from the neighbours.
+        Returns {side: message} for the neighbours plus the snapshot of the shard as 0.'''
+        for side, message in sorted(messages.items()):
+            self.receive(side, message)
+        w = self.world
+        w.time += timespan
+        w.process_mutables(timespan)
+        w.process_decay()
+        w.process_collisions(timespan)
+        out = {-1: get_empty_message(), 1: get_empty_message()}
+        # hits on ghosts go to their owners, ghosts never explode here
+        for uid, (ghost, side) in self.ghosts.iteritems():
+            damage = ghost.ghost_hit_points - ghost.hit_points
+            ghost.hit_points = ghost.ghost_hit_points
+            if ghost.alive and damage > 0:
+                out[side]['damage'].append((uid, damage))
+        w.process_explosions()
+        # spacecrafts leaving are still in this tick's snapshot, the neighbour sends them from the next one
+        migrants = []
+        for uid, spacecraft in self.owned.items():
+            if not spacecraft.alive:
+                self.remove_spacecraft(spacecraft)
+                del self.owned[uid]
+                continue
+            side = self.get_side(spacecraft.position[0])
+            if side:
+                out[side]['spacecrafts'].append(get_spacecraft_state(spacecraft))
+                migrants.append(spacecraft)
+                self.remove_spacecraft(spacecraft)
+                del self.owned[uid]
+                continue
+            if spacecraft.position[0] < self.left + self.margin:
+                out[-1]['ghosts'].append(get_spacecraft_state(spacecraft))
+            if spacecraft.position[0] >= self.right - self.margin:
+                out[1]['ghosts'].append(get_spacecraft_state(spacecraft))
+        shots = w.shots
+        x = shots.position[:shots.count, 0]
+        alive = shots.ttl[:shots.count] > 0
+        for side, leaving in ((-1, alive & (x < self.left)), (1, alive & (x >= self.right))):
+            indices = numpy.flatnonzero(leaving).tolist()
+            out[side]['shots'] = get_shot_states(w, indices)
+            for i in indices:
+                shots.kill(i)
+        w.flush()
+        out[0] = self.get_snapshot(migrants)
+        return out
+
+    def get_side(self, x):
+        '''Returns where x is: -1 left of the shard, 1 right of it, 0 within.'''
+        if x < self.left:
+            return -1
+        if x >= self.right:
+            return 1
+        return 0
+
+    def get_snapshot(self, migrants = ()):
+        '''Returns what the main process needs to render the shard, mostly as arrays which are quick to send.
+        migrants are the spacecrafts that left the shard this tick.'''
+        p = self.world.particles
+        n = p.count
+        spacecrafts = self.owned.values() + list(migrants)
+        shots = self.world.shots
+        m = shots.count
+        return {'spacecrafts': ([s.uid for s in spacecrafts], [s.blueprint.name for s in spacecrafts],
+                    numpy.array([(s.position[0], s.position[1], s.rotation, s.hit_points) for s in spacecrafts]).reshape((-1, 4))),
+                'shots': (shots.position[:m].copy(), shots.speed[:m].copy(), shots.ttl[:m].copy(), shots.color[:m].copy()),
+                'particles': (p.position[:n].copy(), p.speed[:n].copy(), p.ttl[:n].copy(), p.color[:n].copy())}
+
+def run_worker(connection, left, right, margin, screen_size, seed):
+    '''Main loop of a worker process: ticks its shard whenever the main process asks to.'''
+    random.seed(seed)
+    numpy.random.seed(seed)
+    shard = Shard(left, right, margin, screen_size)
+    while True:
+        message = connection.recv()
+        if message[0] == 'stop':
+            break
+        if message[0] == 'add':
+            for state in message[1]:
+                shard.add_spacecraft(state)
+        elif message[0] == 'tick':
+            connection.send(shard.tick(message[1], message[2]))
+    connection.close()
+
+class LocalWorker:
+    '''Runs a shard in the main process, behind the same interface as a worker process.'''
+    def __init__(self, left, right, margin, screen_size, seed):
+        random.seed(seed)
+        numpy.random.seed(seed)
+        self.shard = Shard(left, right, margin, screen_size)
+        self.result = None
+
+    def send(self, message):
+        if message[0] == 'add':
+            for state in message[1]:
+                self.shard.add_spacecraft(state)
+        elif message[0] == 'tick':
+            self.result = self.shard.tick(message[1], message[2])
+
+    def recv(self):
+        return self.result
+
+    def close(self):
+        pass
+
+class View:
+    '''What the main process renders: proxies of the spacecrafts and shots of all shards and their
+    particles, merged from the shards' snapshots. Drawable like a world.World.'''
+    def __init__(self, screen_size):
+        self.background = world.Background(screen_size)
+        self.planets = []
+        self.spacecrafts = []
+        self.proxies = {}       # uid -> spacecraft
+        self.shots = world.Shots()
+        self.particles = world.Particles()
+        self.render_lag = .0
+        self.fleet = fleet.Fleet(self.spacecrafts)
+
+    def merge(self, snapshots):
+        proxies = {}
+        for snapshot in snapshots:
+            uids, names, data = snapshot['spacecrafts']
+            for uid, name, (x, y, rotation, hit_points) in zip(uids, names, data.tolist()):
+                proxy = self.proxies.get(uid) or world.blueprints[name].spawn()
+                proxy.position = [x, y]
+                proxy.rotation = rotation
+                proxy.hit_points = hit_points
+                proxies[uid] = proxy
+        if set(proxies) != set(self.proxies):
+            self.spacecrafts[:] = proxies.values()
+            self.fleet.invalidate()
+        self.proxies = proxies
+        self.fleet.transform()
+        self.shots.count = 0
+        for snapshot in snapshots:
+            position, speed, ttl, color = snapshot['shots']
+            if len(ttl):
+                self.shots.add(0, ttl, -1, color, position[:, 0], position[:, 1], speed[:, 0], speed[:, 1])
+        self.particles.count = 0
+        for snapshot in snapshots:
+            position, speed, ttl, color = snapshot['particles']
+            if len(ttl):
+                self.particles.emit(color, ttl, position[:, 0], position[:, 1], speed[:, 0], speed[:, 1])
+
+class ShardedWorld:
+    '''Splits the world into shards vertical strips of the given width around x = 0, the outer two
+    reach on to infinity, and simulates each in a worker process (in this process if processes is
+    False). All shards tick in lockstep; what crosses a border arrives in the neighbouring shard one
+    tick later. Entities are added as in a world, a spacecraft's pilot is recreated in its shard.'''
+    def __init__(self, screen_size, shards = 2, width = 1000.0, margin = 300.0, processes = True, seed = 0):
+        self.edges = [-INFINITY] + [(i - shards / 2.0) * width for i in xrange(1, shards)] + [INFINITY]
+        self.time = .0
+        self.next_uid = 0
+        self.workers = []
+        self.processes = []
+        for i in xrange(0, shards):
+            args = (self.edges[i], self.edges[i + 1], margin, screen_size, seed + i)
+            if processes:
+                connection, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target = run_worker, args = (child,) + args)
+                process.daemon = True
+                process.start()
+                self.processes.append(process)
+                self.workers.append(connection)
+            else:
+                self.workers.append(LocalWorker(*args))
+        self.messages = [{-1: get_empty_message(), 1: get_empty_message()} for i in xrange(0, shards)]
+        self.view = View(screen_size)
+
+    def get_shard(self, x):
+        for i in xrange(0, len(self.workers)):
+            if x < self.edges[i + 1]:
+                return i
+
+    def add_entity(self, spacecraft, piloted = None):
+        '''Hands a spacecraft spawned from a blueprint to the shard it is in and returns its uid. The
+        shard gives it a pilot of its own if piloted is True, by default if the spacecraft has one.'''
+        spacecraft.uid = self.next_uid
+        self.next_uid += 1
+        self.workers[self.get_shard(spacecraft.position[0])].send(('add', [get_spacecraft_state(spacecraft, piloted)]))
+        return spacecraft.uid
+
+    def process(self, timespan):
+        '''Ticks all shards, routes what they exchange and merges their snapshots into the view.'''
+        self.time += timespan
+        for worker, messages in zip(self.workers, self.messages):
+            worker.send(('tick', timespan, messages))
+        results = [worker.recv() for worker in self.workers]
+        last = len(self.workers) - 1
+        for i in xrange(0, len(self.workers)):
+            # the left neighbour sends to its right and the other way round
+            self.messages[i] = {-1: results[i - 1][1] if i > 0 else get_empty_message(),
+                                1: results[i + 1][-1] if i < last else get_empty_message()}
+        self.view.merge([result[0] for result in results])
+
+    def close(self):
+        for worker in self.workers:
+            worker.send(('stop',))
+            worker.close()
+        for process in self.processes:
+            process.join()
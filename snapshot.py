@@ -0,0 +1,219 @@
+'''Binary world snapshots, for saving sessions, restoring scenarios and checkpoints.
+
+A snapshot is a header (magic, version) followed by sections, each a 4 byte tag, the length of its
+payload and the payload. Entities are stored as flat arrays of fixed records, one section per kind,
+so loading reads them in bulk instead of unpickling objects. Sections with unknown tags are skipped.
+
+Spacecrafts are stored by blueprint: geometry and stats come from world.blueprints, the snapshot only
+holds what changes while flying (transform, hit points, cooldowns, animation time, pilot). Background
+stars are generated anew. Only snapshots of the current version load.
+
+    with open('session.snap', 'wb') as f:
+        snapshot.save(w, f)
+    with open('session.snap', 'rb') as f:
+        w = snapshot.load(f, screen_size)'''
+
+import gc
+import random
+import struct
+import numpy
+import world
+import pilots
+
+MAGIC = 'SPC0'
+VERSION = 3
+
+HEADER = struct.Struct('<4sH')
+SECTION = struct.Struct('<4sQ')
+
+WORLD_DTYPE = numpy.dtype([('time', '<f8'), ('player', '<i4'), ('scheduler_order', '<i8')])
+SPACECRAFT_DTYPE = numpy.dtype([('blueprint', '<i2'), ('faction', '<i4'), ('position', '<f8', 2), ('speed', '<f8', 2),
+    ('rotation', '<f8'), ('rotate_to', '<f8'), ('previous_position', '<f8', 2), ('previous_rotation', '<f8'),
+    ('hit_points', '<f8'), ('shield_points', '<f8'), ('hit_time', '<f8'), ('steer', '<u1'), ('pilot', '<i1'),
+    ('firing', '<i1'), ('next_think', '<f8')])
+PART_DTYPE = numpy.dtype([('attack_cooldown', '<f8'), ('animation_time', '<f8')])
+SHOT_DTYPE = numpy.dtype([('attack', '<f8'), ('ttl', '<f8'), ('origin', '<i4'), ('faction', '<i4'), ('color', '<u1', 3),
+    ('position', '<f8', 2), ('speed', '<f8', 2)])
+
+# pilot classes by the number stored, 0 is no pilot
+PILOTS = [None, pilots.AI_Pilot_Basic]
+
+NAN = float('nan')
+
+def write_section(f, tag, data):
+    f.write(SECTION.pack(tag, len(data)))
+    f.write(data)
+
+def read_sections(f):
+    '''Reads a snapshot from file object f and returns its sections as {tag: payload}.'''
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError('not a snapshot: too short')
+    magic, version = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('not a snapshot: bad magic %r' % magic)
+    if version != VERSION:
+        raise ValueError('snapshot version %d, expected %d' % (version, VERSION))
+    sections = {}
+    while True:
+        head = f.read(SECTION.size)
+        if not head:
+            return sections
+        if len(head) < SECTION.size:
+            raise ValueError('truncated snapshot')
+        tag, length = SECTION.unpack(head)
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError('truncated snapshot')
+        sections[tag] = data
+
+def save(w, f):
+    '''Writes world w to file object f, section by section.'''
+    f.write(HEADER.pack(MAGIC, VERSION))
+    spacecrafts = filter(lambda x: x.alive, w.spacecrafts)
+    for spacecraft in spacecrafts:
+        if spacecraft.blueprint is None:
+            raise ValueError('spacecrafts have to be spawned from a blueprint to be saved')
+    # blueprint names, referenced by number
+    names = sorted(set(s.blueprint.name for s in spacecrafts))
+    ids = dict((name, i) for i, name in enumerate(names))
+    write_section(f, 'NAME', '\n'.join(names))
+    slots = dict((s, i) for i, s in enumerate(spacecrafts))
+    handle_slots = dict((s.handle, i) for i, s in enumerate(spacecrafts))
+
+    header = numpy.zeros(1, WORLD_DTYPE)
+    header['time'] = w.time
+    header['player'] = slots.get(w.player, -1)
+    header['scheduler_order'] = w.scheduler.order
+    write_section(f, 'WRLD', header.tobytes())
+
+    records = numpy.zeros(len(spacecrafts), SPACECRAFT_DTYPE)
+    records['blueprint'] = [ids[s.blueprint.name] for s in spacecrafts]
+    records['faction'] = [s.faction for s in spacecrafts]
+    records['position'] = [s.position for s in spacecrafts]
+    records['speed'] = [s.speed for s in spacecrafts]
+    records['rotation'] = [s.rotation for s in spacecrafts]
+    records['rotate_to'] = [s.rotate_to for s in spacecrafts]
+    records['previous_position'] = [s.previous_position or (NAN, NAN) for s in spacecrafts]
+    records['previous_rotation'] = [s.previous_rotation for s in spacecrafts]
+    records['hit_points'] = [s.hit_points for s in spacecrafts]
+    records['shield_points'] = [s.shield_points for s in spacecrafts]
+    records['hit_time'] = [NAN if s.hit_time is None else s.hit_time for s in spacecrafts]
+    # pilots keep steering the same way until they think again
+    records['steer'] = [sum(1 << i for i in xrange(0, 4) if s.steer[i]) for s in spacecrafts]
+    records['pilot'] = [PILOTS.index(s.pilot.__class__) if s.pilot else 0 for s in spacecrafts]
+    records['firing'] = [s.pilot.firing if s.pilot else 0 for s in spacecrafts]
+    records['next_think'] = [s.pilot.next_think if s.pilot and s.pilot.next_think is not None else NAN for s in spacecrafts]
+    write_section(f, 'SHIP', records.tobytes())
+
+    # parts in the order of their spacecrafts, every blueprint knows how many
+    parts = [part for s in spacecrafts for part in s.parts]
+    records = numpy.zeros(len(parts), PART_DTYPE)
+    records['attack_cooldown'] = [part.attack_cooldown for part in parts]
+    records['animation_time'] = [part.animation_time if part.animator else NAN for part in parts]
+    write_section(f, 'PART', records.tobytes())
+
+    shots = w.shots
+    alive = shots.ttl[:shots.count] > 0
+    records = numpy.zeros(int(numpy.count_nonzero(alive)), SHOT_DTYPE)
+    records['attack'] = shots.attack[:shots.count][alive]
+    records['ttl'] = shots.ttl[:shots.count][alive]
+    records['origin'] = [handle_slots.get(h, -1) for h in shots.origin[:shots.count][alive].tolist()]
+    records['faction'] = shots.faction[:shots.count][alive]
+    records['color'] = shots.color[:shots.count][alive]
+    records['position'] = shots.position[:shots.count][alive]
+    records['speed'] = shots.speed[:shots.count][alive]
+    write_section(f, 'SHOT', records.tobytes())
+
+    p = w.particles
+    n = p.count
+    write_section(f, 'PTCL', struct.pack('<Q', n) + p.position[:n].astype('<f8').tobytes() + p.speed[:n].astype('<f8').tobytes() +
+        p.ttl[:n].astype('<f8').tobytes() + p.color[:n].astype('<f8').tobytes())
+
+    # random's state is (version, 625 words, gauss_next), numpy's (name, 624 words, pos, has_gauss, cached_gaussian)
+    version, words, gauss_next = random.getstate()
+    name, keys, pos, has_gauss, cached_gaussian = numpy.random.get_state()
+    write_section(f, 'RAND', struct.pack('<iBd', version, gauss_next is not None, gauss_next or 0) + numpy.array(words, '<u4').tobytes() +
+        struct.pack('<iid', pos, has_gauss, cached_gaussian) + keys.astype('<u4').tobytes())
+
+def load(f, screen_size):
+    '''Reads a world from file object f.'''
+    sections = read_sections(f)
+    # loading creates thousands of objects and frees none, collecting on the way would only cost time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return build_world(sections, screen_size)
+    finally:
+        if enabled:
+            gc.enable()
+
+def build_world(sections, screen_size):
+    '''Builds a world from the sections of a snapshot.'''
+    names = sections['NAME'].split('\n') if sections['NAME'] else []
+    blueprints = [world.blueprints[name] for name in names]
+    header = numpy.frombuffer(sections['WRLD'], WORLD_DTYPE)[0]
+    w = world.World(screen_size, False, False)
+    w.time = float(header['time'])
+    w.scheduler.order = int(header['scheduler_order'])
+
+    records = numpy.frombuffer(sections['SHIP'], SPACECRAFT_DTYPE)
+    parts = numpy.frombuffer(sections['PART'], PART_DTYPE)
+    attack_cooldowns = parts['attack_cooldown'].tolist()
+    animation_times = parts['animation_time'].tolist()
+    spacecrafts = [blueprints[i].spawn() for i in records['blueprint'].tolist()]
+    p = 0
+    for spacecraft, faction, position, speed, rotation, rotate_to, previous_position, previous_rotation, hit_points, shield_points, hit_time, steer, pilot, firing, next_think in zip(
+            spacecrafts, records['faction'].tolist(), records['position'].tolist(), records['speed'].tolist(),
+            records['rotation'].tolist(), records['rotate_to'].tolist(), records['previous_position'].tolist(),
+            records['previous_rotation'].tolist(), records['hit_points'].tolist(), records['shield_points'].tolist(),
+            records['hit_time'].tolist(), records['steer'].tolist(), records['pilot'].tolist(), records['firing'].tolist(), records['next_think'].tolist()):
+        spacecraft.faction = faction
+        spacecraft.position = position
+        spacecraft.speed = speed
+        spacecraft.rotation = rotation
+        spacecraft.rotate_to = rotate_to
+        # nan never equals itself
+        spacecraft.previous_position = previous_position if previous_position == previous_position else None
+        spacecraft.previous_rotation = previous_rotation
+        spacecraft.hit_points = hit_points
+        spacecraft.shield_points = shield_points
+        spacecraft.hit_time = hit_time if hit_time == hit_time else None
+        spacecraft.steer = [bool(steer & 1 << i) for i in xrange(0, 4)]
+        for part in spacecraft.parts:
+            part.attack_cooldown = attack_cooldowns[p]
+            if part.animator:
+                part.animation_time = animation_times[p]
+            p += 1
+        if pilot:
+            spacecraft.pilot = PILOTS[pilot](spacecraft, w)
+            spacecraft.pilot.firing = bool(firing)
+            spacecraft.pilot.next_think = next_think if next_think == next_think else None
+        w.add_entity(spacecraft)
+    player = int(header['player'])
+    w.player = spacecrafts[player] if player >= 0 else None
+
+    records = numpy.frombuffer(sections['SHOT'], SHOT_DTYPE)
+    if len(records):
+        # slot -1 is no origin
+        handles = numpy.array([s.handle for s in spacecrafts] + [-1])
+        position = records['position']
+        speed = records['speed']
+        w.shots.add(records['attack'], records['ttl'], handles[records['origin']], records['color'], position[:, 0], position[:, 1], speed[:, 0], speed[:, 1],
+            records['faction'])
+
+    data = sections['PTCL']
+    n = struct.unpack('<Q', data[:8])[0]
+    arrays = numpy.frombuffer(data, '<f8', offset = 8)
+    w.particles.count = 0
+    w.particles.emit(arrays[n * 5:n * 8].reshape((n, 3)), arrays[n * 4:n * 5], arrays[0:n * 2:2], arrays[1:n * 2:2],
+        arrays[n * 2:n * 4:2], arrays[n * 2 + 1:n * 4:2])
+
+    data = sections['RAND']
+    version, has_gauss_next, gauss_next = struct.unpack('<iBd', data[:13])
+    words = tuple(numpy.frombuffer(data, '<u4', 625, 13).tolist())
+    random.setstate((version, words, gauss_next if has_gauss_next else None))
+    pos, has_gauss, cached_gaussian = struct.unpack('<iid', data[13 + 2500:13 + 2500 + 16])
+    keys = numpy.frombuffer(data, '<u4', 624, 13 + 2500 + 16).copy()
+    numpy.random.set_state(('MT19937', keys, pos, has_gauss, cached_gaussian))
+    return w
@@ -0,0 +1,128 @@
+'''Spatial queries over points, such as spacecraft positions.'''
+
+import math
+import numpy
+
+class SpatialIndex:
+    '''Snapshot of points with a bit mask each (factions, one bit each), bucketed into a uniform grid.
+    Queries return indices into the points, nearest first, and only consider points whose mask
+    shares a bit with the factions argument. Build a new index when the points move.'''
+    def __init__(self, positions, masks, cell_size = 256):
+        self.positions = numpy.array(positions, dtype = float).reshape((-1, 2))
+        self.masks = numpy.array(masks, dtype = int)
+        self.cell_size = float(cell_size)
+        self.cells = {}     # (cx, cy) -> indices of the points in the cell
+        if not len(self.positions):
+            return
+        cells = numpy.floor(self.positions / self.cell_size).astype(int)
+        order = numpy.lexsort((cells[:, 1], cells[:, 0]))
+        cells = cells[order]
+        # first point of every cell in the sorted order
+        starts = numpy.flatnonzero(numpy.concatenate(([True], (cells[1:] != cells[:-1]).any(axis = 1))))
+        ends = numpy.append(starts[1:], len(order))
+        for start, end, cell in zip(starts.tolist(), ends.tolist(), cells[starts].tolist()):
+            self.cells[tuple(cell)] = order[start:end]
+        # the same as sorted cell keys, for nearest_batch()
+        self.cell_min = cells.min(axis = 0)
+        self.cell_max = cells.max(axis = 0)
+        self.rows = self.cell_max[1] - self.cell_min[1] + 1
+        self.keys = (cells[:, 0] - self.cell_min[0]) * self.rows + cells[:, 1] - self.cell_min[1]
+        self.order = order
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get_candidates(self, point, radius):
+        '''Returns the indices of the points in the cells a circle touches.'''
+        c = self.cell_size
+        cx0, cy0 = int(math.floor((point[0] - radius) / c)), int(math.floor((point[1] - radius) / c))
+        cx1, cy1 = int(math.floor((point[0] + radius) / c)), int(math.floor((point[1] + radius) / c))
+        # visiting more cells than there are occupied ones doesn't pay off
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            return numpy.arange(len(self.positions))
+        found = []
+        for cx in xrange(cx0, cx1 + 1):
+            for cy in xrange(cy0, cy1 + 1):
+                indices = self.cells.get((cx, cy))
+                if indices is not None:
+                    found.append(indices)
+        return numpy.concatenate(found) if found else numpy.zeros(0, dtype = int)
+
+    def filter(self, indices, point, radius, factions, exclude):
+        '''Returns the indices and distances of the given points within radius, nearest first.'''
+        if factions != ~0:
+            indices = indices[(self.masks[indices] & factions) != 0]
+        if exclude is not None:
+            indices = indices[indices != exclude]
+        d = self.positions[indices] - point
+        dist = numpy.sqrt(d[:, 0]**2 + d[:, 1]**2)
+        within = dist <= radius
+        indices = indices[within]
+        dist = dist[within]
+        order = numpy.argsort(dist, kind = 'mergesort')
+        return indices[order], dist[order]
+
+    def nearest(self, point, k = 1, factions = ~0, exclude = None):
+        '''Returns the indices of the k points nearest to point, fewer if there aren't enough.'''
+        if not len(self.positions):
+            return numpy.zeros(0, dtype = int)
+        # grow the search circle until it holds k points, no point outside can be nearer
+        radius = self.cell_size
+        while True:
+            indices = self.get_candidates(point, radius)
+            everything = len(indices) == len(self.positions)
+            found, dist = self.filter(indices, point, numpy.inf if everything else radius, factions, exclude)
+            if len(found) >= k or everything:
+                return found[:k]
+            radius *= 2
+
+    def nearest_batch(self, points, k = 1, factions = ~0, exclude = None):
+        '''Answers many nearest() queries at once. factions and exclude can be a value per point.
+        Returns an array (len(points), k) of indices, -1 where there aren't enough points. Like
+        nearest(), every round gathers the points in the cells around the queries and grows the
+        search circle of the queries that haven't found k points yet.'''
+        points = numpy.array(points, dtype = float).reshape((-1, 2))
+        result = numpy.empty((len(points), k), dtype = int)
+        result.fill(-1)
+        if not len(self.positions) or not len(points):
+            return result
+        factions = numpy.resize(numpy.array(factions, dtype = int), len(points))
+        if exclude is not None:
+            exclude = numpy.resize(numpy.array(exclude, dtype = int), len(points))
+        active = numpy.arange(len(points))
+        radius = self.cell_size
+        while len(active):
+            p = points[active]
+            # block of cells the circle touches, clipped to the occupied ones
+            lo = numpy.clip(numpy.floor((p - radius) / self.cell_size).astype(int), self.cell_min, self.cell_max)
+            hi = numpy.clip(numpy.floor((p + radius) / self.cell_size).astype(int), self.cell_min, self.cell_max)
+            everything = ((lo == self.cell_min) & (hi == self.cell_max)).all(axis = 1)
+            size = hi - lo + 1
+            counts = size[:, 0] * size[:, 1]
+            owner = numpy.repeat(numpy.arange(len(active)), counts)
+            offset = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+            keys = (lo[owner, 0] - self.cell_min[0] + offset // size[owner, 1]) * self.rows + \
+                lo[owner, 1] - self.cell_min[1] + offset % size[owner, 1]
+            # points of those cells, a candidate per query and point
+            starts = numpy.searchsorted(self.keys, keys, 'left')
+            counts = numpy.searchsorted(self.keys, keys, 'right') - starts
+            query = numpy.repeat(owner, counts)
+            indices = self.order[numpy.arange(counts.sum()) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)]
+            valid = (self.masks[indices] & factions[active][query]) != 0
+            if exclude is not None:
+                valid &= indices != exclude[active][query]
+            d = self.positions[indices] - p[query]
+            dist = d[:, 0]**2 + d[:, 1]**2
+            valid &= (dist <= radius**2) | everything[query]
+            query, indices, dist = query[valid], indices[valid], dist[valid]
+            found = numpy.bincount(query, minlength = len(active))
+            done = (found >= k) | everything
+            # the k nearest of every query that is done
+            order = numpy.lexsort((dist, query))
+            query, indices = query[order], indices[order]
+            rank = numpy.arange(len(query)) - (numpy.cumsum(found) - found)[query]
+            take = done[query] & (rank < k)
+            result[active[query[take]], rank[take]] = indices[take]
+            active = active[~done]
+            radius *= 2
+        return result
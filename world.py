@@ -2,7 +2,12 @@ import random
 import pygame
 import math
 import copy
+import numpy
 import pilots
+import broadphase
+import registry
+import fleet
+import spatial
 
 class Gradient:
     def __init__(self, color_list):
@@ -33,123 +38,276 @@ class Drawable:
         self.position = [x, y]
         self.rotation = rotation
 
-class Mutable(Drawable):
-    '''Just an aestetic class. Every subclass has to implement process() itself.'''
-    def __init__(self, x, y, rotation = .0):
+class Movable(Drawable):
+    def __init__(self, x, y, rotation = .0, sx = .0, sy = .0):
         Drawable.__init__(self, x, y, rotation)
+        self.speed = [sx, sy]
 
-    def process(self, timespan):
-        pass
+# collision layers, one bit each
+LAYER_SPACECRAFT = 1
+LAYER_SHOT = 2
 
-class Movable(Mutable):
-    def __init__(self, x, y, rotation = .0, sx = .0, sy = .0):
-        Mutable.__init__(self, x, y, rotation)
-        self.speed = [sx, sy]
+# shots whose ways this tick come closer than this hit each other, if shots collide with shots
+SHOT_DISTANCE = 3.0
 
-    def process(self, timespan):
-        self.position[0] += self.speed[0] * timespan
-        self.position[1] += self.speed[1] * timespan
+# factions, one bit each
+FACTION_PLAYER = 1
+FACTION_HOSTILE = 2
+FACTIONS_ALL = FACTION_PLAYER | FACTION_HOSTILE
 
 class Collidable:
+    collision_layer = 0
+
     def __init__(self, shapes):
         self.shapes = shapes
-
-class Decayable:
-    def __init__(self, ttl):
-        self.ttl = ttl
-
-    def process(self, timespan):
-        self.ttl = max(self.ttl - timespan, 0)
+        self.bounds = None      # (min_x, min_y, max_x, max_y) of the real shapes, set when they are translated
 
 # INSTANTIABLE
-class Star(Drawable):
-    def __init__(self, x, y, z, star_gradient):
-        Drawable.__init__(self, x, y)
-        self.position.append(z)
-        a = (103 - z) / 104.0 + .1     # +.1 to make almost black stars a little lighter
-        self.color = star_gradient.get_color_at(a)
-
-    def reset(self, camera):
-        v = (camera.position[0] - self.position[0], camera.position[1] - self.position[1])
-        self.position[0] += v[0] * 2
-        self.position[1] += v[1] * 2
-
 class Planet(Drawable):
     def __init__(self, x, y, size):
         Drawable.__init__(self, x, y)
         self.size = size
 
-class Particle(Movable, Decayable):
-    def __init__(self, color, ttl, x, y, sx = .0, sy = .0):
-        Movable.__init__(self, x, y, .0, sx, sy)
-        Decayable.__init__(self, ttl)
-        self.color = color
+class Particles:
+    '''Structure of arrays holding all particles of a world. Particle i has position[i], speed[i], ttl[i]
+    and color[i] for i < count, the arrays grow as needed. All particles are moved and expired in bulk.'''
+    def __init__(self, capacity = 1024):
+        self.count = 0
+        self.position = numpy.zeros((capacity, 2))
+        self.speed = numpy.zeros((capacity, 2))
+        self.ttl = numpy.zeros(capacity)
+        self.color = numpy.zeros((capacity, 3))
+
+    def __len__(self):
+        return self.count
+
+    def emit(self, color, ttl, x, y, sx = .0, sy = .0):
+        '''Adds particles. ttl, x, y, sx and sy are numbers or arrays of the same length, color is (r, g, b).'''
+        n = max(numpy.size(ttl), numpy.size(x), numpy.size(y), numpy.size(sx), numpy.size(sy))
+        start = self.count
+        end = start + n
+        if end > len(self.ttl):
+            self.grow(max(end, len(self.ttl) * 2))
+        self.position[start:end, 0] = x
+        self.position[start:end, 1] = y
+        self.speed[start:end, 0] = sx
+        self.speed[start:end, 1] = sy
+        self.ttl[start:end] = ttl
+        self.color[start:end] = color
+        self.count = end
+
+    def grow(self, capacity):
+        for name in ('position', 'speed', 'ttl', 'color'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:])
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
 
     def process(self, timespan):
-        Movable.process(self, timespan)
-        Decayable.process(self, timespan)
+        n = self.count
+        self.position[:n] += self.speed[:n] * timespan
+        ttl = self.ttl[:n]
+        ttl -= timespan
+        numpy.maximum(ttl, 0, ttl)
+
+    def remove_decayed(self):
+        '''Compacts the arrays, dropping all particles whose ttl ran out.'''
+        n = self.count
+        alive = self.ttl[:n] > 0
+        count = int(numpy.count_nonzero(alive))
+        if count == n:
+            return
+        for array in (self.position, self.speed, self.ttl, self.color):
+            array[:count] = array[:n][alive]
+        self.count = count
+
+class Shots:
+    '''Structure of arrays holding all shots of a world, like Particles. Shot i has position[i], speed[i],
+    ttl[i], attack[i], the handle of the spacecraft that fired it in origin[i] (-1 if none), its
+    faction[i], the color it is drawn in, color[i], and id[i], which no other shot of the world gets.
+    lines[i] is its line (x1, y1, x2, y2), centered at its position and pointing where it flies,
+    sweep[i] the line from the back of the line before the last tick to its front after it, which is
+    what collides. Shots are moved and expired in bulk, kill() marks a single one dead and
+    remove_decayed() drops the dead ones, keeping the order of the rest.'''
+    collision_layer = LAYER_SHOT
+
+    def __init__(self, capacity = 256):
+        self.count = 0
+        self.position = numpy.zeros((capacity, 2))
+        self.speed = numpy.zeros((capacity, 2))
+        self.ttl = numpy.zeros(capacity)
+        self.attack = numpy.zeros(capacity)
+        self.origin = numpy.zeros(capacity, dtype = int)
+        self.faction = numpy.zeros(capacity, dtype = int)
+        self.id = numpy.zeros(capacity, dtype = numpy.int64)
+        self.next_id = 0
+        self.color = numpy.zeros((capacity, 3), dtype = numpy.uint8)
+        self.lines = numpy.zeros((capacity, 4))
+        self.sweep = numpy.zeros((capacity, 4))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, attack, ttl, origin, color, x, y, sx = .0, sy = .0, faction = 0):
+        '''Adds shots. attack, ttl, origin, x, y, sx, sy and faction are numbers or arrays of the same
+        length, color is (r, g, b) or an array of them. Returns the index of the first new shot.'''
+        n = max(numpy.size(attack), numpy.size(ttl), numpy.size(origin), numpy.size(color) / 3,
+            numpy.size(x), numpy.size(y), numpy.size(sx), numpy.size(sy), numpy.size(faction))
+        start = self.count
+        end = start + n
+        if end > len(self.ttl):
+            self.grow(max(end, len(self.ttl) * 2))
+        self.position[start:end, 0] = x
+        self.position[start:end, 1] = y
+        self.speed[start:end, 0] = sx
+        self.speed[start:end, 1] = sy
+        self.ttl[start:end] = ttl
+        self.attack[start:end] = attack
+        self.origin[start:end] = origin
+        self.faction[start:end] = faction
+        self.id[start:end] = numpy.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+        self.color[start:end] = color
+        self.count = end
+        self.place_lines(start, end, self.position[start:end])
+        self.sweep[start:end] = self.lines[start:end]
+        return start
+
+    def grow(self, capacity):
+        for name in ('position', 'speed', 'ttl', 'attack', 'origin', 'faction', 'id', 'color', 'lines', 'sweep'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], dtype = old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
 
-class Shot(Movable, Collidable, Decayable):
-    def __init__(self, attack, ttl, origin, x, y, sx = .0, sy = .0):
-        Movable.__init__(self, x, y, .0, sx, sy)
-        Collidable.__init__(self, [Line(None, (-2, 0), (2, 0))])
-        Decayable.__init__(self, ttl)
-        self.attack = attack
-        self.origin = origin
+    def place_lines(self, start, end, position):
+        '''Centers the lines of shots start to end at position, pointing where the shots fly.'''
+        half = self.speed[start:end] / 40
+        self.lines[start:end, 0:2] = position - half
+        self.lines[start:end, 2:4] = position + half
 
     def process(self, timespan):
-        Movable.process(self, timespan)
-        Decayable.process(self, timespan)
-        self.shapes[0].real_start = [self.position[0] - self.speed[0] / 40, self.position[1] - self.speed[1] / 40]
-        self.shapes[0].real_end = [self.position[0] + self.speed[0] / 40, self.position[1] + self.speed[1] / 40]
+        n = self.count
+        position = self.position[:n]
+        # collision is tested along the whole way the lines travelled this tick
+        self.sweep[:n, 0:2] = position - self.speed[:n] / 40
+        position += self.speed[:n] * timespan
+        ttl = self.ttl[:n]
+        ttl -= timespan
+        numpy.maximum(ttl, 0, ttl)
+        self.place_lines(0, n, position)
+        self.sweep[:n, 2:4] = self.lines[:n, 2:4]
+
+    def interpolate(self, lag):
+        '''Moves the lines to where the shots were lag seconds ago, for rendering.'''
+        n = self.count
+        self.place_lines(0, n, self.position[:n] - self.speed[:n] * lag)
+
+    def get_bounds(self):
+        '''Returns the bounding boxes (min_x, min_y, max_x, max_y) of the sweeps, one row per shot.'''
+        sweep = self.sweep[:self.count]
+        return numpy.hstack((numpy.minimum(sweep[:, 0:2], sweep[:, 2:4]), numpy.maximum(sweep[:, 0:2], sweep[:, 2:4])))
+
+    def kill(self, i):
+        '''Marks shot i as dead, it is dropped by the next remove_decayed().'''
+        self.ttl[i] = 0
+
+    def remove_decayed(self):
+        '''Compacts the arrays, dropping all shots whose ttl ran out or that were killed.'''
+        n = self.count
+        alive = self.ttl[:n] > 0
+        count = int(numpy.count_nonzero(alive))
+        if count == n:
+            return
+        for array in (self.position, self.speed, self.ttl, self.attack, self.origin, self.faction, self.id, self.color, self.lines, self.sweep):
+            array[:count] = array[:n][alive]
+        self.count = count
 
 class Stats:
     def __init__(self, hit_points_max = 0, hit_heal = 0, attack = 0, attack_cooldown_max = 0, attack_speed = 0, attack_ttl = 0, shield_points_max = 0, shield_heal = 0, rotation_speed = 0, accerlation = 0, speed_max = 0):
         self.hit_points_max = float(hit_points_max)
-        self.hit_points = self.hit_points_max
         self.hit_heal = float(hit_heal)
         self.attack = float(attack)
         self.attack_cooldown_max = float(attack_cooldown_max)
-        self.attack_cooldown = .0
         self.attack_speed = float(attack_speed)
         self.attack_ttl = float(attack_ttl)
         self.shield_points_max = float(shield_points_max)
-        self.shield_points = self.shield_points_max
         self.shield_heal = float(shield_heal)
         self.rotation_speed = float(rotation_speed)
         self.accerlation = float(accerlation)
         self.speed_max = float(speed_max)
 
-class Shape:
-    def __init__(self, color):
+class Shape(object):
+    '''Shapes keep their points as flat float arrays (x0, y0, x1, y1, ...): local holds the part
+    coordinates, real the world coordinates. Both can be views into bigger arrays.'''
+    __slots__ = ('color', 'local', 'real')
+
+    def __init__(self, color, points):
         self.color = color
+        self.local = numpy.array(points, dtype = float).reshape(-1)
+        self.real = numpy.zeros(len(self.local))
+
+    def get_points(self):
+        return self.local.reshape((-1, 2))
+
+    def get_real_points(self):
+        return self.real.reshape((-1, 2))
+
+    def instance(self, share = True):
+        '''Returns a copy with its own real coordinates, sharing the local ones unless share is False.'''
+        shape = object.__new__(type(self))
+        shape.color = self.color
+        shape.local = self.local if share else self.local.copy()
+        shape.real = numpy.zeros(len(self.local))
+        return shape
 
 class Line(Shape):
+    __slots__ = ()
+
     def __init__(self, color, start, end):
-        Shape.__init__(self, color)
-        self.start = start
-        self.end = end
-        self.real_start = [.0, .0]
-        self.real_end = [.0, .0]
+        Shape.__init__(self, color, (start, end))
+
+    def set_start(self, point):
+        self.local[0:2] = point
+
+    def set_end(self, point):
+        self.local[2:4] = point
+
+    start = property(lambda self: self.local[0:2], set_start)
+    end = property(lambda self: self.local[2:4], set_end)
+    real_start = property(lambda self: self.real[0:2])
+    real_end = property(lambda self: self.real[2:4])
 
 class Circle(Shape):
+    __slots__ = ('radius',)
+
     def __init__(self, color, center, radius):
-        Shape.__init__(self, color)
-        self.center = center
+        Shape.__init__(self, color, center)
         self.radius = radius
-        self.real_center = [.0, .0]
+
+    def instance(self, share = True):
+        shape = Shape.instance(self, share)
+        shape.radius = self.radius
+        return shape
+
+    center = property(lambda self: self.local)
+    real_center = property(lambda self: self.real)
 
 class Poly(Shape):
+    __slots__ = ()
+
     def __init__(self, color, pointlist):
-        Shape.__init__(self, color)
-        self.pointlist = pointlist
-        self.real_pointlist = [[.0, .0] for x in pointlist]
+        Shape.__init__(self, color, pointlist)
+
+    pointlist = property(Shape.get_points)
+    real_pointlist = property(Shape.get_real_points)
 
 class Part(Drawable, Collidable):
     def __init__(self, stats, shapes, x, y, rotation = .0, animator = None):
         Drawable.__init__(self, x, y, rotation)
         Collidable.__init__(self, shapes)
         self.stats = stats
+        self.attack_cooldown = .0
         self.animator = animator
         if animator:
             self.animation_time = random.random() * 100
@@ -158,87 +316,38 @@ class Part(Drawable, Collidable):
         if self.animator:
             self.animation_time += timespan
             self.animator(self.shapes, self.animation_time)
-        if self.stats.attack_cooldown > 0:
-            self.stats.attack_cooldown = max(self.stats.attack_cooldown - timespan, 0)
+        if self.attack_cooldown > 0:
+            self.attack_cooldown = max(self.attack_cooldown - timespan, 0)
 
 class Spacecraft(Movable, Collidable):
-    def __init__(self, parts):
+    '''Moved, piloted and transformed by the world's fleet.Fleet, together with all other spacecrafts.'''
+    collision_layer = LAYER_SPACECRAFT
+
+    def __init__(self, parts, stats = None, radius = None, faction = 0):
+        '''stats and radius are derived from the parts unless given, see Blueprint.'''
         Movable.__init__(self, .0, .0)
         self.parts = parts
-        self.stats = Stats()
+        self.faction = faction
+        self.blueprint = None   # set when spawned from a blueprint
+        self.stats = stats or get_total_stats(parts)
+        self.hit_points = self.stats.hit_points_max
+        self.shield_points = self.stats.shield_points_max
+        self.weapons = [part for part in parts if part.stats.attack > 0]
+        self.hit_time = None    # world time of the last hit
         self.pilot = None
         shapes = []
         for part in self.parts:
             shapes += part.shapes
-            self.stats.hit_points_max += part.stats.hit_points_max
-            self.stats.hit_points += part.stats.hit_points
-            self.stats.hit_heal += part.stats.hit_heal
-            self.stats.shield_points_max += part.stats.shield_points_max
-            self.stats.shield_points += part.stats.shield_points
-            self.stats.shield_heal += part.stats.shield_heal
-            self.stats.rotation_speed += part.stats.rotation_speed
-            self.stats.accerlation += part.stats.accerlation
-            self.stats.speed_max += part.stats.speed_max
         Collidable.__init__(self, shapes)
+        # distance from position to the farthest point of any shape, whatever the rotation
+        self.radius = get_spacecraft_radius(parts) if radius is None else radius
         self.steer = [False] * 4
+        self.fire = False       # shoot in the next tick, for spacecrafts without a pilot, see fleet.Fleet
         self.rotate_to = 0
-
-    def process(self, timespan):
-        # piloting
-        if self.pilot:
-            self.pilot.pilot()
-        # steering
-        if self.steer[0]:   # straight
-            self.speed[0] += math.cos(self.rotation) * self.stats.accerlation * timespan
-            self.speed[1] -= math.sin(self.rotation) * self.stats.accerlation * timespan
-        if self.steer[1]:   # back
-            self.speed[0] += math.cos(self.rotation + math.pi) * self.stats.accerlation * timespan
-            self.speed[1] -= math.sin(self.rotation + math.pi) * self.stats.accerlation * timespan
-        if self.steer[2]:   # left
-            self.speed[0] += math.cos(self.rotation + math.pi / 2) * self.stats.accerlation * timespan
-            self.speed[1] -= math.sin(self.rotation + math.pi / 2) * self.stats.accerlation * timespan
-        if self.steer[3]:   # right
-            self.speed[0] += math.cos(self.rotation - math.pi / 2) * self.stats.accerlation * timespan
-            self.speed[1] -= math.sin(self.rotation - math.pi / 2) * self.stats.accerlation * timespan
-        for x in xrange(0, 4):
-            self.steer[x] = False
-        # rotation
-        if abs(self.rotate_to - self.rotation) <= self.stats.rotation_speed * timespan:
-            self.rotation = self.rotate_to
-        else:
-            if self.rotation > self.rotate_to:
-                self.rotation -= self.stats.rotation_speed * timespan
-            else:
-                self.rotation += self.stats.rotation_speed * timespan
-        # respect the speed limit
-        speed = math.sqrt(self.speed[0]**2 + self.speed[1]**2)
-        if speed > self.stats.speed_max:
-            shrink = self.stats.speed_max / speed
-            self.speed[0] *= shrink
-            self.speed[1] *= shrink
-        # misc
-        Movable.process(self, timespan)
-        for part in self.parts:
-            part.process(timespan)
-        self.translate_shapes()
-
-    def translate_shapes(self):
-        cos = math.cos(self.rotation)
-        sin = math.sin(self.rotation)
-        for i in xrange(0, len(self.parts)):
-            dx = self.position[0] + cos * self.parts[i].position[0] + sin * self.parts[i].position[1]
-            dy = self.position[1] + cos * self.parts[i].position[1] - sin * self.parts[i].position[0]
-            for shape in self.parts[i].shapes:
-                cos2 = math.cos(self.rotation + self.parts[i].rotation)
-                sin2 = math.sin(self.rotation + self.parts[i].rotation)
-                if isinstance(shape, Line):
-                    shape.real_start = [cos2 * shape.start[0] + sin2 * shape.start[1] + dx, cos2 * shape.start[1] - sin2 * shape.start[0] + dy]
-                    shape.real_end = [cos2 * shape.end[0] + sin2 * shape.end[1] + dx, cos2 * shape.end[1] - sin2 * shape.end[0] + dy]
-                if isinstance(shape, Circle):
-                    shape.real_center = [cos2 * shape.center[0] + sin2 * shape.center[1] + dx, cos2 * shape.center[1] - sin2 * shape.center[0] + dy]
-                if isinstance(shape, Poly):
-                    for x in xrange(0, len(shape.pointlist)):
-                        shape.real_pointlist[x] = [cos2 * shape.pointlist[x][0] + sin2 * shape.pointlist[x][1] + dx, cos2 * shape.pointlist[x][1] - sin2 * shape.pointlist[x][0] + dy]
+        # state of the previous tick, for render interpolation
+        self.previous_position = None
+        self.previous_rotation = .0
+        self.render_position = self.position
 
     def steer_straight(self):
         self.steer[0] = True
@@ -261,141 +370,613 @@ class Spacecraft(Movable, Collidable):
             self.rotate_to += math.pi * 2
 
     def shoot(self, world):
-        for weapon in filter(lambda x: x.stats.attack > 0 and x.stats.attack_cooldown <= 0, self.parts):
-            shot = Shot(weapon.stats.attack, weapon.stats.attack_ttl, self, weapon.shapes[0].real_start[0], weapon.shapes[0].real_start[1], math.cos(self.rotation) * weapon.stats.attack_speed, -math.sin(self.rotation) * weapon.stats.attack_speed)
-            weapon.stats.attack_cooldown = weapon.stats.attack_cooldown_max
-            world.add_entity(shot)
+        # shot color is the color of the first part's first shape
+        color = tuple(self.parts[0].shapes[0].color)[:3]
+        for weapon in filter(lambda x: x.attack_cooldown <= 0, self.weapons):
+            x, y = weapon.shapes[0].real[0:2].tolist()
+            world.shots.add(weapon.stats.attack, weapon.stats.attack_ttl, self.handle, color, x, y,
+                math.cos(self.rotation) * weapon.stats.attack_speed, -math.sin(self.rotation) * weapon.stats.attack_speed, self.faction)
+            weapon.attack_cooldown = weapon.stats.attack_cooldown_max
 
     def explode(self, world):
         # generate some particles
-        for x in xrange(0, 500):
-            angle = random.random() * math.pi * 2
-            speed = (1 - random.random()**5) * 110
-            sx = math.cos(angle) * speed
-            sy = math.sin(angle) * speed
-            ttl = (1 - random.random()**2) * 2
-            world.add_entity(Particle((255, 232, 0), ttl, self.position[0], self.position[1], sx, sy))
+        angle = numpy.random.random(500) * math.pi * 2
+        speed = (1 - numpy.random.random(500)**5) * 110
+        ttl = (1 - numpy.random.random(500)**2) * 2
+        world.particles.emit((255, 232, 0), ttl, self.position[0], self.position[1], numpy.cos(angle) * speed, numpy.sin(angle) * speed)
         world.remove_entity(self)
 
+class Blueprint:
+    '''A spacecraft compiled once from prototype parts. Every spacecraft spawned from it shares the
+    geometry, the parts' and total stats and the radius, and only gets its own state: transform,
+    hit points, cooldowns and animation time. Shared local points are made read-only, shapes of
+    animated parts get their own copy. The name is the key in blueprints, it identifies the
+    blueprint in spacecraft states that are sent or stored.'''
+    def __init__(self, name, parts, faction = 0):
+        self.name = name
+        self.faction = faction
+        self.parts = [(part.stats, part.shapes, part.position[0], part.position[1], part.rotation, part.animator) for part in parts]
+        self.stats = get_total_stats(parts)
+        self.radius = get_spacecraft_radius(parts)
+        for part in parts:
+            if not part.animator:
+                for shape in part.shapes:
+                    shape.local.flags.writeable = False
+
+    def spawn(self):
+        parts = [Part(stats, [shape.instance(animator is None) for shape in shapes], x, y, rotation, animator)
+            for stats, shapes, x, y, rotation, animator in self.parts]
+        spacecraft = Spacecraft(parts, self.stats, self.radius, self.faction)
+        spacecraft.blueprint = self
+        return spacecraft
+
 class Background(Drawable):
-    def __init__(self, screen_size):
+    '''An endless starfield. Stars lie at depths 11 to 102, a star at depth z moves 1 / z as fast as
+    the camera and the far ones are darker. The depths are grouped into bands, all stars of band i
+    move as if at depths[i]. Every band is cut into tiles of tile_size pixels on screen, and the stars
+    of a tile are derived from (seed, band, tile) by get_tile(), so a tile looks the same whenever it
+    comes back into view and nothing has to be stored per star.'''
+    def __init__(self, screen_size, bands = 6, tile_size = 256, seed = None):
         self.star_gradient = Gradient([(0, 0, 0, 0), (.4, 16, 16, 96), (1, 255, 255, 255)])
-        self.stars = []
-        for z in xrange(102, 10, -1):
-            for i in range(z**2 / 100 + 1):
-                self.stars.append(Star((random.random() - .5) * z * screen_size[0], (random.random() - .5) * z * screen_size[1], z, self.star_gradient))
+        self.tile_size = tile_size
+        self.seed = random.getrandbits(32) if seed is None else seed
+        levels = numpy.arange(11, 103)
+        # as many stars per screen at depth z as the fixed starfield had
+        counts = levels**2 / 100 + 1
+        self.colors = numpy.array([self.star_gradient.get_color_at((103 - z) / 104.0 + .1) for z in levels.tolist()], dtype = float)   # +.1 to make almost black stars a little lighter
+        # bands of equal depth ratios
+        edges = 11 * (103 / 11.0)**(numpy.arange(bands + 1) / float(bands))
+        self.depths = numpy.sqrt(edges[:-1] * edges[1:]).tolist()
+        band_of_level = numpy.minimum(numpy.searchsorted(edges, levels, 'right') - 1, bands - 1)
+        self.levels = []        # per band (indices in colors, their probabilities)
+        self.densities = []     # per band stars per square pixel on screen
+        for band in xrange(0, bands):
+            indices = numpy.flatnonzero(band_of_level == band)
+            self.levels.append((indices, counts[indices] / float(counts[indices].sum())))
+            self.densities.append(counts[indices].sum() / float(screen_size[0] * screen_size[1]))
+
+    def get_tile(self, band, tx, ty):
+        '''Returns the stars of tile (tx, ty) of band as arrays x, y (pixels within the tile) and their colors.'''
+        rng = numpy.random.RandomState([self.seed, band, tx & 0xffffffff, ty & 0xffffffff])
+        size = self.tile_size
+        n = rng.poisson(self.densities[band] * size**2)
+        # off the last row and column, so anti-aliasing stays within the tile
+        x = rng.random_sample(n) * (size - 1)
+        y = rng.random_sample(n) * (size - 1)
+        indices, p = self.levels[band]
+        return x, y, self.colors[rng.choice(indices, n, p = p)]
 
 class World:
-    def __init__(self, screen_size):
+    def __init__(self, screen_size, hostiles = True, player = True):
         # stars
         self.background = Background(screen_size)
         # planets
         self.planets = [Planet(20, 50, .667)]
 
-        self.player = Spacecraft(
-            [Part(Stats(hit_points_max = 100, hit_heal = 1), get_shapes('chassis_one'), 0, 0, 0),
-             Part(Stats(attack = 10, attack_cooldown_max = .5, attack_speed = 200, attack_ttl = 2.0), get_shapes('laser_one'), 2, 6, 0),
-             Part(Stats(attack = 10, attack_cooldown_max = .5, attack_speed = 200, attack_ttl = 2.0), get_shapes('laser_one'), 2, -6, 0),
-             Part(Stats(rotation_speed = 2, accerlation = 50, speed_max = 100), get_shapes('engine_one'), -4, 0, 0, animator_engine_one)])
-
-        self.hostile = Spacecraft(
-            [Part(Stats(hit_points_max = 100, rotation_speed = 1.25, accerlation = 50, speed_max = 60), paint_shapes(get_shapes('chassis_one'), col_red), 0, 0, 0),
-             Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 2, 6, 0),
-             Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 2, -6, 0)])
-        self.hostile.position = [100.0, 10.0]
-        self.hostile.rotation = 1.0
-        self.hostile.pilot = pilots.AI_Pilot_Basic(self.hostile, self)
-
-        self.hostile2 = Spacecraft(
-            [Part(Stats(hit_points_max = 100, rotation_speed = 1.25, accerlation = 50, speed_max = 60), paint_shapes(get_shapes('chassis_two'), col_red), 0, 0, 0),
-             Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 8, 10, 0),
-             Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 8, -10, 0)])
-        self.hostile2.position = [-50.0, -10.0]
-        self.hostile2.pilot = pilots.AI_Pilot_Basic(self.hostile2, self)
-
-        self.hostile3 = Spacecraft(
-            [Part(Stats(hit_points_max = 1000, rotation_speed = 0.5, accerlation = 10, speed_max = 50), paint_shapes(get_shapes('chassis_mudda_one'), col_red), 0, 0, 0)])
-        self.hostile3.position = [10.0, 100.0]
-        self.hostile3.pilot = pilots.AI_Pilot_Basic(self.hostile3, self)
-
-        # fast access lists
-        self.spacecrafts = [self.player, self.hostile, self.hostile2, self.hostile3]
-        self.shots = []
-        self.particles = []
-        self.mutable = [self.player, self.hostile, self.hostile2, self.hostile3]
-        self.collidable = [self.player, self.hostile, self.hostile2, self.hostile3]
-        self.decayable = []
+        # fast access lists, entities are removed from them at the end of a tick
+        self.entities = registry.Registry(('spacecrafts',))
+        self.spacecrafts = self.entities.lists['spacecrafts']
+        self.particles = Particles()
+        self.shots = Shots()
+        # decides when pilots think
+        self.scheduler = pilots.Scheduler(self)
+        # spacecrafts are processed all at once
+        self.fleet = fleet.Fleet(self.spacecrafts, self.scheduler, self)
+        # {layer: bitmask of layers it collides with}, see set_collision()
+        self.collision_masks = {}
+        self.set_collision(LAYER_SPACECRAFT, LAYER_SHOT, True)
+        # {faction: bitmask of factions it collides with}, missing factions collide with all, see set_faction_collision()
+        self.faction_masks = {}
+        # collision statistics of the last tick: pairs found by the broad phase, those filtered out by
+        # origin, ttl or faction, those skipped because they were asleep and those left for the narrow phase
+        self.collision_counters = {'pairs': 0, 'pairs_filtered': 0, 'pairs_skipped': 0, 'narrow_phase': 0}
+        # spacecraft/shot pairs that can't touch yet sleep until they might, see get_awake_pairs()
+        self.wake_keys = numpy.zeros(0, dtype = numpy.int64)    # spacecraft handle << 32 | shot id, sorted
+        self.wake_times = numpy.zeros(0)
+        # spacecraft positions for spatial queries, built at most once per tick, see get_spatial_index()
+        self.spatial_index = None
+        self.spatial_spacecrafts = []
+        self.spatial_slots = {}     # spacecraft -> index in spatial_spacecrafts
+        self.spatial_time = None
+        self.time = .0
+        self.explosions = 0     # spacecrafts exploded so far
+        # how many seconds rendering lags behind the last tick, see interpolate()
+        self.render_lag = .0
+
+        self.player = None
+        if player:
+            self.player = build_player()
+            self.add_entity(self.player)
+
+        if hostiles:
+            self.hostile = build_hostile_one()
+            self.hostile.position = [100.0, 10.0]
+            self.hostile.rotation = 1.0
+            self.hostile.pilot = pilots.AI_Pilot_Basic(self.hostile, self)
+            self.add_entity(self.hostile)
+
+            self.hostile2 = build_hostile_two()
+            self.hostile2.position = [-50.0, -10.0]
+            self.hostile2.pilot = pilots.AI_Pilot_Basic(self.hostile2, self)
+            self.add_entity(self.hostile2)
+
+            self.hostile3 = build_hostile_mudda_one()
+            self.hostile3.position = [10.0, 100.0]
+            self.hostile3.pilot = pilots.AI_Pilot_Basic(self.hostile3, self)
+            self.add_entity(self.hostile3)
 
     def add_entity(self, entity):
+        '''Adds entity to the fast access lists it belongs to and returns its handle.
+        A spacecraft's pilot has to be set before, to be scheduled.'''
+        categories = []
         if isinstance(entity, Spacecraft):
-            self.spacecrafts.append(entity)
-        if isinstance(entity, Shot):
-            self.shots.append(entity)
-        if isinstance(entity, Particle):
-            self.particles.append(entity)
-        if isinstance(entity, Mutable):
-            self.mutable.append(entity)
-        if isinstance(entity, Collidable):
-            self.collidable.append(entity)
-        if isinstance(entity, Decayable):
-            self.decayable.append(entity)
+            categories.append('spacecrafts')
+            self.fleet.invalidate()
+            if entity.pilot:
+                self.scheduler.add(entity.pilot)
+            self.spatial_index = None
+        return self.entities.add(entity, categories)
 
     def remove_entity(self, entity):
-        if isinstance(entity, Spacecraft):
-            self.spacecrafts.remove(entity)
-        if isinstance(entity, Shot):
-            self.shots.remove(entity)
-        if isinstance(entity, Particle):
-            self.particles.remove(entity)
-        if isinstance(entity, Mutable):
-            self.mutable.remove(entity)
-        if isinstance(entity, Collidable):
-            self.collidable.remove(entity)
-        if isinstance(entity, Decayable):
-            self.decayable.remove(entity)
+        '''Marks entity as dead (entity.alive is False from now on), it leaves the lists at the end of the tick.'''
+        self.entities.kill(entity)
+
+    def flush(self):
+        '''Removes the entities and shots that died during the tick.'''
+        for entity in self.entities.flush():
+            if isinstance(entity, Spacecraft):
+                self.fleet.invalidate()
+        self.shots.remove_decayed()
+
+    def get_spatial_index(self):
+        '''Returns a spatial.SpatialIndex of the living spacecrafts (spatial_spacecrafts) and their
+        factions. It is rebuilt in the next tick or when spacecrafts are added.'''
+        if self.spatial_index is None or self.spatial_time != self.time:
+            self.spatial_spacecrafts = filter(lambda x: x.alive, self.spacecrafts)
+            self.spatial_slots = dict((s, i) for i, s in enumerate(self.spatial_spacecrafts))
+            self.spatial_index = spatial.SpatialIndex([s.position for s in self.spatial_spacecrafts],
+                [s.faction for s in self.spatial_spacecrafts], 256)
+            self.spatial_time = self.time
+        return self.spatial_index
+
+    def get_spacecrafts(self, indices):
+        '''Turns indices of a spatial query into the spacecrafts that are still alive.'''
+        return [self.spatial_spacecrafts[i] for i in indices if i >= 0 and self.spatial_spacecrafts[i].alive]
+
+    def find_nearest(self, position, k = 1, factions = ~0, exclude = None):
+        '''Returns up to k spacecrafts of the given factions (bit mask) nearest to position, nearest first.
+        exclude is a spacecraft to leave out, e.g. the one asking.'''
+        index = self.get_spatial_index()
+        return self.get_spacecrafts(index.nearest(position, k, factions, self.spatial_slots.get(exclude)))
+
+    def find_nearest_batch(self, positions, k = 1, factions = ~0, excludes = None):
+        '''Answers find_nearest() for many positions at once, factions and excludes are lists with an
+        entry per position. Returns a list of spacecraft lists.'''
+        index = self.get_spatial_index()
+        if excludes is not None:
+            excludes = [self.spatial_slots.get(x, -1) for x in excludes]
+        return [self.get_spacecrafts(row) for row in index.nearest_batch(positions, k, factions, excludes).tolist()]
 
     def spacecraft_hit_by_shot(self, spacecraft, shot, position):
+        '''Handles a hit of spacecraft at position by shot, an index in self.shots.'''
+        sx, sy = self.shots.speed[shot].tolist()
         # generate some particles
-        for x in xrange(0, 10):
-            angle = math.atan2(shot.speed[1], shot.speed[0]) + (random.random() + random.random()) - 1 + math.pi
-            speed = math.sqrt(shot.speed[0]**2 + shot.speed[1]**2) * (random.random() * random.random() / 2 + 0.05)
-            sx = math.cos(angle) * speed
-            sy = math.sin(angle) * speed
-            ttl = random.random() + 1
-            self.add_entity(Particle((255, 255, 0), ttl, position[0], position[1], sx, sy))
+        angle = math.atan2(sy, sx) + (numpy.random.random(10) + numpy.random.random(10)) - 1 + math.pi
+        speed = math.sqrt(sx**2 + sy**2) * (numpy.random.random(10) * numpy.random.random(10) / 2 + 0.05)
+        ttl = numpy.random.random(10) + 1
+        self.particles.emit((255, 255, 0), ttl, position[0], position[1], numpy.cos(angle) * speed, numpy.sin(angle) * speed)
         # decrease spacecraft hp
-        spacecraft.stats.hit_points -= shot.attack
+        spacecraft.hit_points -= float(self.shots.attack[shot])
+        spacecraft.hit_time = self.time
         # remove shot
-        self.remove_entity(shot)
-
-def collides(shapes1, shapes2):
-    '''Takes two shape sequences and checks if they overlap. Returns (x, y) if they do, else None.'''
-    for shape1 in shapes1:
-        if isinstance(shape1, Line):
-            line1 = shape1
-            for shape2 in shapes2:
-                if isinstance(shape2, Line):
-                    line2 = shape2
-                    # check if the two lines intersect
-                    x1 = line1.real_start[0]
-                    y1 = line1.real_start[1]
-                    x2 = line1.real_end[0]
-                    y2 = line1.real_end[1]
-                    x3 = line2.real_start[0]
-                    y3 = line2.real_start[1]
-                    x4 = line2.real_end[0]
-                    y4 = line2.real_end[1]
-                    # don't calculate the intersection point if the bounding boxes don't overlap
-                    if min(x1, x2) <= max(x3, x4) and min(x3, x4) <= max(x1, x2) and min(y1, y2) <= max(y3, y4) and min(y3, y4) <= max(y1, y2):
-                        denominator = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
-                        # abort on (almost) parallel lines
-                        if denominator < 5:
-                            continue
-                        x = ((x1 * y2 - y1 * x2) * (x3 - x4) - (x1 - x2) * (x3 * y4 - y3 * x4)) / denominator
-                        y = ((x1 * y2 - y1 * x2) * (y3 - y4) - (y1 - y2) * (x3 * y4 - y3 * x4)) / denominator
-                        # check if the intersection point is in the overlap box
-                        if x <= max(x1, x2, x3, x4) and x >= min(x1, x2, x3, x4) and y <= max(y1, y2, y3, y4) and y >= min(y1, y2, y3, y4):
-                            return x, y
+        self.shots.kill(shot)
+
+    def set_collision(self, layer1, layer2, enabled):
+        '''Enables or disables collision detection between two collision layers. Spacecrafts hit by
+        shots take damage, shots that hit each other are destroyed and spacecrafts that touch bounce off.'''
+        for a, b in ((layer1, layer2), (layer2, layer1)):
+            if enabled:
+                self.collision_masks[a] = self.collision_masks.get(a, 0) | b
+            else:
+                self.collision_masks[a] = self.collision_masks.get(a, 0) & ~b
+
+    def set_faction_collision(self, faction1, faction2, enabled):
+        '''Enables or disables collisions between the spacecrafts and shots of two factions, e.g. to
+        turn off friendly fire. A shot belongs to the faction of the spacecraft that fired it.'''
+        for a, b in ((faction1, faction2), (faction2, faction1)):
+            if enabled:
+                self.faction_masks[a] = self.faction_masks.get(a, FACTIONS_ALL) | b
+            else:
+                self.faction_masks[a] = self.faction_masks.get(a, FACTIONS_ALL) & ~b
+
+    def get_faction_collisions(self, factions1, factions2):
+        '''Returns which of the pairs of factions factions1[i] and factions2[i] (arrays) collide.
+        Spacecrafts and shots without a faction collide with all.'''
+        masks = numpy.array([self.faction_masks.get(faction, FACTIONS_ALL) for faction in xrange(0, FACTIONS_ALL + 1)])
+        return (factions1 == 0) | (factions2 == 0) | ((masks[factions1] & factions2) != 0)
+
+    def shot_hit_by_shot(self, shot1, shot2, position):
+        '''Handles two shots, indices in self.shots, hitting each other at position: both are destroyed,
+        unless one of them already was this tick.'''
+        if self.shots.ttl[shot1] <= 0 or self.shots.ttl[shot2] <= 0:
+            return
+        angle = numpy.random.random(6) * math.pi * 2
+        speed = numpy.random.random(6) * 40
+        self.particles.emit((255, 255, 0), numpy.random.random(6) * .5 + .5, position[0], position[1], numpy.cos(angle) * speed, numpy.sin(angle) * speed)
+        self.shots.kill(shot1)
+        self.shots.kill(shot2)
+
+    def spacecraft_hit_by_spacecraft(self, spacecraft1, spacecraft2, position):
+        '''Handles two spacecrafts touching at position: if they are closing in, they swap the parts of
+        their speeds along the line between them, like equal masses bouncing off each other.'''
+        nx = spacecraft2.position[0] - spacecraft1.position[0]
+        ny = spacecraft2.position[1] - spacecraft1.position[1]
+        length = math.sqrt(nx**2 + ny**2)
+        if length == 0:
+            return
+        nx /= length
+        ny /= length
+        closing = (spacecraft1.speed[0] - spacecraft2.speed[0]) * nx + (spacecraft1.speed[1] - spacecraft2.speed[1]) * ny
+        if closing <= 0:
+            return
+        spacecraft1.speed = [spacecraft1.speed[0] - closing * nx, spacecraft1.speed[1] - closing * ny]
+        spacecraft2.speed = [spacecraft2.speed[0] + closing * nx, spacecraft2.speed[1] + closing * ny]
+
+    def process(self, timespan, profiler = None):
+        '''Advances the world by timespan seconds. A profiler, if given, gets a lap per phase.'''
+        self.time += timespan
+        if profiler is None:
+            self.process_mutables(timespan)
+            self.process_decay()
+            self.process_collisions(timespan)
+            self.process_explosions()
+            self.flush()
+            return
+        profiler.count('ticks')
+        self.process_mutables(timespan)
+        profiler.lap('process')
+        self.process_decay()
+        profiler.lap('decay')
+        self.process_collisions(timespan)
+        profiler.lap('collision')
+        profiler.count('pairs', self.collision_counters['pairs'])
+        profiler.count('pairs_skipped', self.collision_counters['pairs_skipped'])
+        profiler.count('narrow_phase', self.collision_counters['narrow_phase'])
+        self.process_explosions()
+        profiler.lap('explosions')
+        self.flush()
+        profiler.lap('flush')
+
+    def process_mutables(self, timespan):
+        self.fleet.process(timespan)
+        self.shots.process(timespan)
+        self.particles.process(timespan)
+
+    def process_decay(self):
+        self.shots.remove_decayed()
+        self.particles.remove_decayed()
+
+    def process_explosions(self):
+        # check if spacecraft's still living
+        for spacecraft in self.spacecrafts:
+            if spacecraft.hit_points <= 0 and spacecraft.alive:
+                spacecraft.explode(self)
+                self.explosions += 1
+
+    def interpolate(self, alpha, timespan):
+        '''Prepares rendering a state in between the previous tick (alpha = 0) and the last one
+        (alpha = 1), timespan being the length of a tick.'''
+        self.render_lag = (1 - alpha) * timespan
+        self.fleet.interpolate(alpha)
+        self.shots.interpolate(self.render_lag)
+
+    def process_collisions(self, timespan):
+        '''Finds what collides this tick, for the pairs of collision layers enabled in collision_masks
+        and the pairs of factions enabled in faction_masks: shots that hit spacecrafts, shots that hit
+        each other and spacecrafts that touch. For each, a broad phase pairs up the bounding boxes all
+        at once, see broadphase.get_pairs_between(), and a narrow phase tests the lines of the pairs.'''
+        counters = self.collision_counters
+        counters['pairs'] = counters['pairs_filtered'] = counters['pairs_skipped'] = counters['narrow_phase'] = 0
+        masks = self.collision_masks
+        spacecrafts = [s for s in self.spacecrafts if s.alive and s.bounds]
+        if masks.get(LAYER_SPACECRAFT, 0) & LAYER_SHOT:
+            self.collide_spacecrafts_shots(spacecrafts, timespan)
+        if masks.get(LAYER_SHOT, 0) & LAYER_SHOT:
+            self.collide_shots()
+        if masks.get(LAYER_SPACECRAFT, 0) & LAYER_SPACECRAFT:
+            self.collide_spacecrafts(spacecrafts)
+
+    def collide_spacecrafts_shots(self, spacecrafts, timespan):
+        '''Tests the swept lines of the shots against the lines of the spacecrafts, skipping the pairs
+        that are asleep.'''
+        counters = self.collision_counters
+        shots = self.shots
+        if not shots.count or not spacecrafts:
+            self.wake_keys = self.wake_keys[:0]
+            self.wake_times = self.wake_times[:0]
+            return
+        bounds = shots.get_bounds()
+        i, j = broadphase.get_pairs_between(numpy.array([s.bounds for s in spacecrafts]), bounds, 64)
+        counters['pairs'] += len(i)
+        # a shot never hits its origin, dead ones hit nothing
+        factions = numpy.array([s.faction for s in spacecrafts])
+        keep = (numpy.array([s.handle for s in spacecrafts])[i] != shots.origin[j]) & (shots.ttl[j] > 0) & \
+            self.get_faction_collisions(factions[i], shots.faction[j])
+        i = i[keep]
+        j = j[keep]
+        counters['pairs_filtered'] += len(keep) - len(i)
+        n = len(i)
+        i, j = self.get_awake_pairs(spacecrafts, i, j, timespan)
+        counters['pairs_skipped'] += n - len(i)
+        counters['narrow_phase'] += len(i)
+        # pairs come sorted by list indices, a loaded snapshot goes on the same way
+        pairs = [(spacecrafts[a], b) for a, b in zip(i.tolist(), j.tolist())]
+        for spacecraft, shot, pos in collides_shots(pairs, shots.sweep[j].tolist(), bounds[j].tolist()):
+            self.spacecraft_hit_by_shot(spacecraft, shot, pos)
+
+    def get_awake_pairs(self, spacecrafts, i, j, timespan):
+        '''Temporal coherence for the pairs of spacecrafts[i] and shots j (index arrays): a pair too far
+        apart to touch this tick sleeps until the earliest time it might, its distance divided by the
+        spacecraft's maximum speed plus the shot's speed, and is skipped until then. Wake times are
+        kept per pair while the broad phase keeps finding it. Returns the pairs that are awake and near.'''
+        if not len(i):
+            self.wake_keys = self.wake_keys[:0]
+            self.wake_times = self.wake_times[:0]
+            return i, j
+        shots = self.shots
+        keys = (numpy.array([s.handle for s in spacecrafts], dtype = numpy.int64)[i] << 32) | shots.id[j]
+        asleep = numpy.zeros(len(keys), dtype = bool)
+        times = numpy.zeros(len(keys))
+        if len(self.wake_keys):
+            slots = numpy.minimum(numpy.searchsorted(self.wake_keys, keys), len(self.wake_keys) - 1)
+            times = self.wake_times[slots]
+            asleep = (self.wake_keys[slots] == keys) & (times > self.time)
+        awake = numpy.flatnonzero(~asleep)
+        a = i[awake]
+        b = j[awake]
+        # gap between the spacecraft's bounding circle and the way of the shot this tick
+        position = numpy.array([s.position for s in spacecrafts])[a]
+        radius = numpy.array([s.radius for s in spacecrafts])[a]
+        speed_max = numpy.array([s.stats.speed_max for s in spacecrafts])[a]
+        speed = numpy.sqrt((shots.speed[b]**2).sum(axis = 1))
+        dist = numpy.sqrt(((position - shots.position[b])**2).sum(axis = 1))
+        gap = dist - radius - speed / 40 - speed * timespan
+        near = gap <= 0
+        far = ~near
+        closing = speed_max[far] + speed[far]
+        wake = numpy.where(closing > 0, self.time + gap[far] / numpy.maximum(closing, 1e-9), numpy.inf)
+        # pairs the broad phase didn't find are forgotten
+        keys = numpy.concatenate((keys[asleep], keys[awake[far]]))
+        times = numpy.concatenate((times[asleep], wake))
+        order = numpy.argsort(keys)
+        self.wake_keys = keys[order]
+        self.wake_times = times[order]
+        return a[near], b[near]
+
+    def collide_shots(self):
+        '''Tests the swept lines of the shots against each other. Shots mostly meet head-on, along
+        parallel lines, so they are tested by distance, see SHOT_DISTANCE.'''
+        counters = self.collision_counters
+        shots = self.shots
+        if shots.count < 2:
+            return
+        # boxes of shots within SHOT_DISTANCE of each other overlap
+        bounds = shots.get_bounds()
+        bounds[:, 0:2] -= SHOT_DISTANCE / 2
+        bounds[:, 2:4] += SHOT_DISTANCE / 2
+        i, j = broadphase.get_pairs_between(bounds, bounds, 64)
+        first = i < j
+        i = i[first]
+        j = j[first]
+        counters['pairs'] += len(i)
+        # the shots of one spacecraft fly side by side, they never collide
+        origin = shots.origin
+        keep = ((origin[i] != origin[j]) | (origin[i] == -1)) & (shots.ttl[i] > 0) & (shots.ttl[j] > 0) & \
+            self.get_faction_collisions(shots.faction[i], shots.faction[j])
+        i = i[keep]
+        j = j[keep]
+        counters['pairs_filtered'] += len(keep) - len(i)
+        counters['narrow_phase'] += len(i)
+        hits = numpy.flatnonzero(get_line_distances(shots.sweep[i], shots.sweep[j]) <= SHOT_DISTANCE)
+        position = (shots.position[i[hits]] + shots.position[j[hits]]) / 2
+        for shot1, shot2, pos in zip(i[hits].tolist(), j[hits].tolist(), position.tolist()):
+            self.shot_hit_by_shot(shot1, shot2, pos)
+
+    def collide_spacecrafts(self, spacecrafts):
+        '''Tests the lines of the spacecrafts against each other.'''
+        counters = self.collision_counters
+        if len(spacecrafts) < 2:
+            return
+        bounds = numpy.array([s.bounds for s in spacecrafts])
+        i, j = broadphase.get_pairs_between(bounds, bounds, 64)
+        first = i < j
+        i = i[first]
+        j = j[first]
+        counters['pairs'] += len(i)
+        factions = numpy.array([s.faction for s in spacecrafts])
+        keep = self.get_faction_collisions(factions[i], factions[j])
+        i = i[keep]
+        j = j[keep]
+        counters['pairs_filtered'] += len(keep) - len(i)
+        counters['narrow_phase'] += len(i)
+        pairs = [(spacecrafts[a], spacecrafts[b]) for a, b in zip(i.tolist(), j.tolist())]
+        for spacecraft1, spacecraft2, pos in collides_spacecrafts(pairs):
+            self.spacecraft_hit_by_spacecraft(spacecraft1, spacecraft2, pos)
+
+def get_radius(shapes):
+    '''Returns the distance from the origin to the farthest point of a shape sequence's local coordinates.'''
+    radius = 0
+    for shape in shapes:
+        pad = shape.radius if isinstance(shape, Circle) else 0
+        radius = max(radius, float(numpy.sqrt(shape.local[0::2]**2 + shape.local[1::2]**2).max()) + pad)
+    return radius
+
+def get_spacecraft_radius(parts):
+    '''Returns the distance from a spacecraft's position to the farthest point of its parts' shapes, whatever the rotation.'''
+    return max([math.sqrt(part.position[0]**2 + part.position[1]**2) + get_radius(part.shapes) for part in parts] + [0])
+
+def get_total_stats(parts):
+    '''Returns the stats of a spacecraft made of parts.'''
+    stats = Stats()
+    for part in parts:
+        stats.hit_points_max += part.stats.hit_points_max
+        stats.hit_heal += part.stats.hit_heal
+        stats.shield_points_max += part.stats.shield_points_max
+        stats.shield_heal += part.stats.shield_heal
+        stats.rotation_speed += part.stats.rotation_speed
+        stats.accerlation += part.stats.accerlation
+        stats.speed_max += part.stats.speed_max
+    return stats
+
+def get_enemy_factions(faction):
+    '''Returns the bit mask of the factions hostile to faction.'''
+    return FACTIONS_ALL & ~faction
+
+def merge_bounds(bounds_list):
+    '''Returns the bounding box enclosing all given bounding boxes, skipping None.'''
+    bounds_list = [b for b in bounds_list if b]
+    if not bounds_list:
+        return None
+    return (min(b[0] for b in bounds_list), min(b[1] for b in bounds_list), max(b[2] for b in bounds_list), max(b[3] for b in bounds_list))
+
+def bounds_overlap(bounds1, bounds2):
+    return bounds1[0] <= bounds2[2] and bounds2[0] <= bounds1[2] and bounds1[1] <= bounds2[3] and bounds2[1] <= bounds1[3]
+
+def collides_shots(pairs, shot_lines, shot_bounds):
+    '''Batched narrow phase for a list of (spacecraft, shot) pairs, shot being an index in Shots.
+    shot_lines[i] and shot_bounds[i] are the swept line (see Shots.process) of the shot of pair i
+    and its bounding box. Gathers the lines of the spacecraft's parts whose bounding boxes overlap
+    the shot and tests them all in a single intersect_lines() call. Returns [(spacecraft, shot, (x, y)), ...]
+    holding the earliest hit along the way of every shot.'''
+    hull = []           # (x1, y1, x2, y2) of all spacecraft lines involved
+    part_ranges = {}    # part -> (start, count) in hull
+    runs = []           # (pair index, start, count) runs of hull lines to test
+    for i in xrange(0, len(pairs)):
+        spacecraft = pairs[i][0]
+        bounds = shot_bounds[i]
+        if not spacecraft.bounds or not bounds_overlap(spacecraft.bounds, bounds):
+            continue
+        for part in spacecraft.parts:
+            if not part.bounds or not bounds_overlap(part.bounds, bounds):
+                continue
+            r = part_ranges.get(part)
+            if r is None:
+                start = len(hull)
+                for shape in part.shapes:
+                    if isinstance(shape, Line):
+                        hull.append(shape.real)
+                r = part_ranges[part] = (start, len(hull) - start)
+            if r[1]:
+                runs.append((i, r[0], r[1]))
+    if not runs:
+        return []
+    runs = numpy.array(runs)
+    counts = runs[:, 2]
+    total = counts.sum()
+    # expand the runs to one row per line test
+    pair_index = numpy.repeat(runs[:, 0], counts)
+    hull_index = numpy.repeat(runs[:, 1] - (numpy.cumsum(counts) - counts), counts) + numpy.arange(total)
+    shot_lines = numpy.array(shot_lines)[pair_index]
+    hit, x, y = intersect_lines(numpy.array(hull)[hull_index], shot_lines)
+    rows = numpy.flatnonzero(hit)
+    if not len(rows):
+        return []
+    # sort hits by shot, then by distance to where the shot was at the beginning of the tick
+    shot_ids = dict()
+    shot_index = numpy.array([shot_ids.setdefault(pairs[i][1], len(shot_ids)) for i in pair_index[rows]])
+    dist = (x[rows] - shot_lines[rows, 0])**2 + (y[rows] - shot_lines[rows, 1])**2
+    order = numpy.lexsort((dist, shot_index))
+    first = numpy.ones(len(order), dtype = bool)
+    first[1:] = shot_index[order][1:] != shot_index[order][:-1]
+    result = []
+    for row in rows[order[first]]:
+        spacecraft, shot = pairs[pair_index[row]]
+        result.append((spacecraft, shot, (float(x[row]), float(y[row]))))
+    return result
+
+def collides_spacecrafts(pairs):
+    '''Narrow phase for a list of (spacecraft, spacecraft) pairs. Tests the lines of every two parts of
+    a pair whose bounding boxes overlap, all in a single intersect_lines_both_ways() call. Returns
+    [(spacecraft1, spacecraft2, (x, y)), ...] holding a point of contact of every pair that touches.'''
+    lines1 = []
+    lines2 = []
+    owners = []         # pair index of every line test
+    for k in xrange(0, len(pairs)):
+        spacecraft1, spacecraft2 = pairs[k]
+        for part1 in spacecraft1.parts:
+            if not part1.bounds or not bounds_overlap(part1.bounds, spacecraft2.bounds):
+                continue
+            for part2 in spacecraft2.parts:
+                if not part2.bounds or not bounds_overlap(part1.bounds, part2.bounds):
+                    continue
+                for shape1 in part1.shapes:
+                    if isinstance(shape1, Line):
+                        for shape2 in part2.shapes:
+                            if isinstance(shape2, Line):
+                                lines1.append(shape1.real)
+                                lines2.append(shape2.real)
+                                owners.append(k)
+    if not owners:
+        return []
+    hit, x, y = intersect_lines_both_ways(numpy.array(lines1), numpy.array(lines2))
+    rows = numpy.flatnonzero(hit)
+    owners = numpy.array(owners)[rows]
+    # the first hit of every pair, owners are in ascending order
+    first = numpy.ones(len(rows), dtype = bool)
+    first[1:] = owners[1:] != owners[:-1]
+    return [pairs[k] + ((float(x[row]), float(y[row])),) for k, row in zip(owners[first].tolist(), rows[first].tolist())]
+
+def intersect_lines_both_ways(lines1, lines2):
+    '''Like intersect_lines(), but whatever the directions of the lines, which intersect_lines() only
+    accepts one way round.'''
+    hit1, x1, y1 = intersect_lines(lines1, lines2)
+    hit2, x2, y2 = intersect_lines(lines2, lines1)
+    return hit1 | hit2, numpy.where(hit1, x1, x2), numpy.where(hit1, y1, y2)
+
+def get_line_distances(lines1, lines2):
+    '''Returns the distances between the lines of two (n, 4) arrays of (x1, y1, x2, y2) rows, row by
+    row: 0 where they cross, otherwise the smallest distance from an end of one line to the other.'''
+    dist = numpy.minimum(numpy.minimum(get_point_line_distances(lines1[:, 0:2], lines2), get_point_line_distances(lines1[:, 2:4], lines2)),
+        numpy.minimum(get_point_line_distances(lines2[:, 0:2], lines1), get_point_line_distances(lines2[:, 2:4], lines1)))
+    dist[intersect_lines_both_ways(lines1, lines2)[0]] = 0
+    return dist
+
+def get_point_line_distances(points, lines):
+    '''Returns the distances of the points of an (n, 2) array to the lines of an (n, 4) array, row by row.'''
+    start = lines[:, 0:2]
+    direction = lines[:, 2:4] - start
+    length = numpy.maximum((direction**2).sum(axis = 1), 1e-12)
+    t = numpy.clip(((points - start) * direction).sum(axis = 1) / length, 0, 1)
+    d = points - start - direction * t[:, numpy.newaxis]
+    return numpy.sqrt((d**2).sum(axis = 1))
+
+def intersect_lines(lines1, lines2):
+    '''Takes two (n, 4) arrays of (x1, y1, x2, y2) rows and tests if row i of lines1 intersects
+    row i of lines2. Returns the arrays (hit, x, y).'''
+    x1, y1, x2, y2 = lines1[:, 0], lines1[:, 1], lines1[:, 2], lines1[:, 3]
+    x3, y3, x4, y4 = lines2[:, 0], lines2[:, 1], lines2[:, 2], lines2[:, 3]
+    min_x12 = numpy.minimum(x1, x2)
+    max_x12 = numpy.maximum(x1, x2)
+    min_y12 = numpy.minimum(y1, y2)
+    max_y12 = numpy.maximum(y1, y2)
+    min_x34 = numpy.minimum(x3, x4)
+    max_x34 = numpy.maximum(x3, x4)
+    min_y34 = numpy.minimum(y3, y4)
+    max_y34 = numpy.maximum(y3, y4)
+    # bounding boxes overlap
+    hit = (min_x12 <= max_x34) & (min_x34 <= max_x12) & (min_y12 <= max_y34) & (min_y34 <= max_y12)
+    denominator = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+    # reject (almost) parallel lines
+    hit &= denominator >= 5
+    denominator = numpy.where(hit, denominator, 1)
+    a = x1 * y2 - y1 * x2
+    b = x3 * y4 - y3 * x4
+    x = (a * (x3 - x4) - (x1 - x2) * b) / denominator
+    y = (a * (y3 - y4) - (y1 - y2) * b) / denominator
+    # intersection point is in the overlap box
+    hit &= (x <= numpy.maximum(max_x12, max_x34)) & (x >= numpy.minimum(min_x12, min_x34))
+    hit &= (y <= numpy.maximum(max_y12, max_y34)) & (y >= numpy.minimum(min_y12, min_y34))
+    return hit, x, y
 
 # PROTOTYPE SECTION
 # colors
@@ -440,4 +1021,39 @@ def animator_engine_one(shapes, animation_time):
     if animation_time >= 3:
         animation_time -= 3
     arg = animation_time / 3. * math.pi * 2.
-    shapes[1].end = (math.cos(arg) * 5, math.sin(arg) * 5)
+    shapes[1].local[2] = math.cos(arg) * 5
+    shapes[1].local[3] = math.sin(arg) * 5
+
+# spacecrafts
+blueprints = {}
+blueprints['player'] = Blueprint('player',
+    [Part(Stats(hit_points_max = 100, hit_heal = 1), get_shapes('chassis_one'), 0, 0, 0),
+     Part(Stats(attack = 10, attack_cooldown_max = .5, attack_speed = 200, attack_ttl = 2.0), get_shapes('laser_one'), 2, 6, 0),
+     Part(Stats(attack = 10, attack_cooldown_max = .5, attack_speed = 200, attack_ttl = 2.0), get_shapes('laser_one'), 2, -6, 0),
+     Part(Stats(rotation_speed = 2, accerlation = 50, speed_max = 100), get_shapes('engine_one'), -4, 0, 0, animator_engine_one)],
+    FACTION_PLAYER)
+blueprints['hostile_one'] = Blueprint('hostile_one',
+    [Part(Stats(hit_points_max = 100, rotation_speed = 1.25, accerlation = 50, speed_max = 60), paint_shapes(get_shapes('chassis_one'), col_red), 0, 0, 0),
+     Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 2, 6, 0),
+     Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 2, -6, 0)],
+    FACTION_HOSTILE)
+blueprints['hostile_two'] = Blueprint('hostile_two',
+    [Part(Stats(hit_points_max = 100, rotation_speed = 1.25, accerlation = 50, speed_max = 60), paint_shapes(get_shapes('chassis_two'), col_red), 0, 0, 0),
+     Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 8, 10, 0),
+     Part(Stats(attack = 2.5, attack_cooldown_max = .75, attack_speed = 100, attack_ttl = 2.0), paint_shapes(get_shapes('laser_one'), col_red), 8, -10, 0)],
+    FACTION_HOSTILE)
+blueprints['hostile_mudda_one'] = Blueprint('hostile_mudda_one',
+    [Part(Stats(hit_points_max = 1000, rotation_speed = 0.5, accerlation = 10, speed_max = 50), paint_shapes(get_shapes('chassis_mudda_one'), col_red), 0, 0, 0)],
+    FACTION_HOSTILE)
+
+def build_player():
+    return blueprints['player'].spawn()
+
+def build_hostile_one():
+    return blueprints['hostile_one'].spawn()
+
+def build_hostile_two():
+    return blueprints['hostile_two'].spawn()
+
+def build_hostile_mudda_one():
+    return blueprints['hostile_mudda_one'].spawn()